@@ -8,14 +8,224 @@
     the string and add the numbers together returning the sum.
 """
 
+import collections
+import os
+import re
+import tempfile
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Expressions with at least this many '+' are summed by calculateLongSum.
+LONG_EXPRESSION_SEPARATORS = 1000
+
 def calculateSum (str):
     if not str:
         return 0
+    if str.count('+') >= LONG_EXPRESSION_SEPARATORS:
+        return calculateLongSum(str)
     return reduce(lambda sum, value: sum + int(value), 
                   str.split('+'), 0)
 
+def calculateLongSum (str):
+    """
+        Sums expressions with many terms without allocating an intermediate
+        big int per term. With numpy, terms that fit into machine words are
+        parsed into an int64 array and added in chunks small enough not to
+        overflow; the chunk sums are then added exactly. Otherwise the
+        builtin sum is used, which adds in machine words until the total
+        overflows and only then switches to big ints.
+    """
+    if not str:
+        return 0
+    if numpy:
+        buffer = numpy.frombuffer(str, dtype=numpy.uint8)
+        terms = _parseTerms(buffer, buffer == ord('+'))
+        if terms is not None:
+            values = terms[1]
+            chunkSize = max(1, (2 ** 63 - 1) // max(1, int(values.max())))
+            return sum(int(values[start:start + chunkSize].sum()) 
+                       for start in range(0, len(values), chunkSize))
+    return sum(map(int, str.split('+')))
+
+class CachingSumCalculator (object):
+    """
+        Memoizing front end for calculateSum. Expressions are normalized
+        (whitespace around '+' and at both ends is dropped) so equivalent
+        inputs share an entry of a bounded LRU cache.
+        
+        With admitOnSecondSight set, an expression is only cached once it
+        has been seen before, so a stream of one-off inputs does not evict
+        the entries that pay off. Single calls can also bypass the cache.
+    """
+    SEPARATOR_PATTERN = re.compile(r'\s*\+\s*')
+    
+    def __init__ (self, size=1024, admitOnSecondSight=False):
+        self.size = size
+        self.admitOnSecondSight = admitOnSecondSight
+        self._cache = collections.OrderedDict()
+        self._seen = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+    
+    @property
+    def hitRate (self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def normalize (self, expression):
+        return CachingSumCalculator.SEPARATOR_PATTERN.sub('+', 
+                                                         expression.strip())
+
+    def calculateSum (self, expression, cache=True):
+        if not expression:
+            return 0
+        if not cache:
+            self.bypasses += 1
+            return calculateSum(expression)
+        
+        normalized = self.normalize(expression)
+        if not normalized:
+            return calculateSum(expression)
+        expression = normalized
+        try:
+            result = self._cache.pop(expression)
+        except KeyError:
+            self.misses += 1
+            result = calculateSum(expression)
+            if self._admit(expression):
+                self._store(expression, result)
+            return result
+        
+        self.hits += 1
+        self._cache[expression] = result
+        return result
+
+    def _admit (self, expression):
+        if not self.admitOnSecondSight:
+            return True
+        if self._seen.pop(expression, None):
+            return True
+        self._seen[expression] = True
+        if len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+        return False
+
+    def _store (self, expression, result):
+        self._cache[expression] = result
+        if len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+def calculateSums (expressions):
+    """
+        Yields the sum of every expression in expressions, which may be any
+        iterable of strings such as an open file. Trailing line breaks are
+        ignored, so empty lines sum up to zero.
+    """
+    for expression in expressions:
+        if expression:
+            expression = expression.rstrip('\r\n')
+        if not expression:
+            yield 0
+        else:
+            yield sum(map(int, expression.split('+')))
+
+def calculateSumsFromFile (fileName, chunkSize=1 << 22):
+    """
+        Yields the sum of every line of a file. With numpy the file is read
+        in chunks of whole lines whose digit runs are parsed directly from
+        the bytes; chunks the vectorized parser cannot handle (signs,
+        malformed or very long numbers) go through calculateSums.
+    """
+    with open(fileName, 'rb') as stream:
+        if not numpy:
+            for value in calculateSums(stream):
+                yield value
+            return
+        
+        while True:
+            data = stream.read(chunkSize)
+            if not data:
+                break
+            if data[-1] != '\n':
+                data += stream.readline()
+            
+            if data[-1] == '\n':
+                data = data[:-1]
+            sums = _sumDigitRuns(data)
+            if sums is None:
+                sums = calculateSums(data.split('\n'))
+            for value in sums:
+                yield value
+
+# Terms with more digits may overflow the int64 accumulators.
+MAX_VECTORIZED_DIGITS = 18
+
+def _parseTerms (buffer, separators):
+    """
+        Parses the terms of buffer, a numpy uint8 array, that are delimited
+        by the positions set in the separators mask. Returns the start
+        offsets and the int64 values of the terms or None when a term is
+        not a single run of at most MAX_VECTORIZED_DIGITS digits surrounded
+        by whitespace.
+    """
+    if not len(buffer):
+        return None
+    
+    digits = (buffer >= ord('0')) & (buffer <= ord('9'))
+    whitespace = (buffer == ord(' ')) | (buffer == ord('\t')) | \
+        (buffer == ord('\n')) | (buffer == ord('\r')) | \
+        (buffer == ord('\x0b')) | (buffer == ord('\x0c'))
+    if not (digits | separators | whitespace).all():
+        return None
+    
+    edges = numpy.diff(numpy.concatenate(([0], digits.view(numpy.int8), [0])))
+    starts = numpy.flatnonzero(edges == 1)
+    lengths = numpy.flatnonzero(edges == -1) - starts
+    
+    # Every term must be exactly one run of digits, as int() expects, so 
+    # runs and separators have to alternate.
+    separators = numpy.flatnonzero(separators)
+    if len(starts) != len(separators) + 1 or \
+            (starts[:-1] > separators).any() or \
+            (starts[1:] < separators).any():
+        return None
+    if lengths.max() > MAX_VECTORIZED_DIGITS:
+        return None
+    
+    values = numpy.zeros(len(starts), dtype=numpy.int64)
+    last = len(buffer) - 1
+    for offset in range(lengths.max()):
+        digit = buffer[numpy.minimum(starts + offset, last)] - ord('0')
+        values = numpy.where(lengths > offset, values * 10 + digit, values)
+    return (starts, values)
+
+def _sumDigitRuns (data):
+    """
+        Sums the numbers of every line of data (without a final line break)
+        using numpy. Returns None when data contains anything but lines of
+        unsigned numbers separated by '+' or when a sum might overflow.
+    """
+    buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+    newlines = buffer == ord('\n')
+    terms = _parseTerms(buffer, (buffer == ord('+')) | newlines)
+    if terms is None:
+        return None
+    
+    (starts, values) = terms
+    if values.astype(numpy.float64).sum() >= 2 ** 62:
+        return None
+    
+    firstRuns = numpy.searchsorted(starts, numpy.flatnonzero(newlines))
+    return numpy.add.reduceat(values, numpy.concatenate(([0], firstRuns)))\
+        .tolist()
+
 class CalculateSumTest (unittest.TestCase):
     def test_shouldReturnZeroWhenNoneIsGiven (self):
         self.assertEquals(0, calculateSum(None))
@@ -37,4 +247,134 @@ class CalculateSumTest (unittest.TestCase):
 
     def test_shouldReturnThreeWhenOnePlusOnePlusOneWithWhitespaceIsGiven (self):
         self.assertEquals(3, calculateSum("1 + 1 + 1"))
-    
\ No newline at end of file
+    
+
+class CalculateLongSumTest (unittest.TestCase):
+    def test_shouldReturnZeroWhenNoneIsGiven (self):
+        self.assertEquals(0, calculateLongSum(None))
+
+    def test_shouldReturnSameSumAsShortExpressions (self):
+        for expression in ["0", "1", "1+1", "1 + 1 + 1", "12+345+6789"]:
+            self.assertEquals(calculateSum(expression), 
+                              calculateLongSum(expression))
+
+    def test_shouldSumTermsOverflowingMachineWordsExactly (self):
+        terms = [str(10 ** 18 - 1)] * 50000
+        
+        self.assertEquals(50000 * (10 ** 18 - 1), 
+                          calculateLongSum('+'.join(terms)))
+        self.assertEquals(50000 * (10 ** 18 - 1), 
+                          calculateSum(' + '.join(terms)))
+
+    def test_shouldSumTermsTooLongForMachineWordsExactly (self):
+        terms = ['1' * 40, '-5'] * 1000
+        
+        self.assertEquals(1000 * (int('1' * 40) - 5), 
+                          calculateSum('+'.join(terms)))
+
+    def test_shouldRaiseValueErrorWhenLongExpressionIsInvalid (self):
+        self.assertRaises(ValueError, calculateLongSum, '1+' * 2000)
+        self.assertRaises(ValueError, calculateLongSum, '1 2+' * 2000 + '1')
+
+class CachingSumCalculatorTest (unittest.TestCase):
+    def test_shouldReturnZeroWhenNoneIsGiven (self):
+        self.assertEquals(0, CachingSumCalculator().calculateSum(None))
+
+    def test_shouldReturnSameSumAsCalculateSum (self):
+        calculator = CachingSumCalculator()
+        
+        self.assertEquals(3, calculator.calculateSum("1 + 1 + 1"))
+        self.assertEquals(3, calculator.calculateSum("1 + 1 + 1"))
+
+    def test_shouldShareEntryForEquivalentExpressions (self):
+        calculator = CachingSumCalculator()
+        calculator.calculateSum("1+1+1")
+        calculator.calculateSum(" 1 + 1 +1 ")
+        
+        self.assertEquals(1, calculator.hits)
+        self.assertEquals(1, calculator.misses)
+        self.assertEquals(0.5, calculator.hitRate)
+
+    def test_shouldNotMakeInvalidExpressionsValid (self):
+        self.assertRaises(ValueError, 
+                          CachingSumCalculator().calculateSum, "1 2")
+        self.assertRaises(ValueError, 
+                          CachingSumCalculator().calculateSum, " ")
+
+    def test_shouldEvictLeastRecentlyUsedExpression (self):
+        calculator = CachingSumCalculator(size=2)
+        calculator.calculateSum("1")
+        calculator.calculateSum("2")
+        calculator.calculateSum("1")
+        calculator.calculateSum("3")
+        calculator.calculateSum("2")
+        
+        self.assertEquals(1, calculator.hits)
+        self.assertEquals(2, calculator.evictions)
+
+    def test_shouldOnlyCacheExpressionsSeenBeforeWhenAdmittingOnSecondSight (self):
+        calculator = CachingSumCalculator(admitOnSecondSight=True)
+        for expression in ["1+1", "1+1", "1+1", "2+2"]:
+            calculator.calculateSum(expression)
+        
+        self.assertEquals(1, calculator.hits)
+        self.assertEquals(3, calculator.misses)
+
+    def test_shouldBypassCacheWhenAsked (self):
+        calculator = CachingSumCalculator()
+        calculator.calculateSum("1+1", cache=False)
+        calculator.calculateSum("1+1", cache=False)
+        
+        self.assertEquals(0, calculator.hits + calculator.misses)
+        self.assertEquals(2, calculator.bypasses)
+
+class CalculateSumsTest (unittest.TestCase):
+    EXPRESSIONS = ["0", "1", "1+1", "1 + 1 + 1", "", "12+345+6789", " 7 "]
+    
+    def setUp (self):
+        (handle, self.fileName) = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown (self):
+        os.remove(self.fileName)
+
+    def writeLines (self, lines):
+        with open(self.fileName, 'wb') as stream:
+            stream.write('\n'.join(lines) + '\n')
+
+    def test_shouldYieldSameSumsAsCalculateSum (self):
+        self.assertEquals(map(calculateSum, CalculateSumsTest.EXPRESSIONS),
+                          list(calculateSums(CalculateSumsTest.EXPRESSIONS)))
+
+    def test_shouldIgnoreLineBreaks (self):
+        self.assertEquals([2, 0, 3], list(calculateSums(["1+1\n", "\r\n", 
+                                                         "3\r\n"])))
+
+    def test_shouldRaiseValueErrorWhenExpressionIsInvalid (self):
+        self.assertRaises(ValueError, list, calculateSums(["1+"]))
+
+    def test_shouldYieldSumsOfFileLines (self):
+        lines = CalculateSumsTest.EXPRESSIONS + ["-1+2", "1\t+2\r", 
+                                                 "9" * 30 + "+1"]
+        self.writeLines(lines)
+        
+        self.assertEquals(map(calculateSum, lines), 
+                          list(calculateSumsFromFile(self.fileName, 
+                                                     chunkSize=4)))
+
+    def test_shouldRaiseValueErrorWhenFileLineIsInvalid (self):
+        self.writeLines(["1+1", "1 1"])
+        
+        self.assertRaises(ValueError, list, 
+                          calculateSumsFromFile(self.fileName))
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_shouldSumDigitRunsWithNumpy (self):
+        self.assertEquals([2, 3, 7, 999999999999999999 + 1], 
+                          _sumDigitRuns('1+1\n 1 + 2\r\n7\n' + 
+                                        '999999999999999999+1'))
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_shouldRefuseInputTheVectorizedParserCannotHandle (self):
+        for data in ['-1', '1+', '1 1', '+', '1\n\n2', '9' * 19]:
+            self.assertEquals(None, _sumDigitRuns(data))
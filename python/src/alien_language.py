@@ -7,44 +7,422 @@
     http://code.google.com/codejam/contest/90101/dashboard
 """
 
+import collections
+import itertools
+import multiprocessing
+import random
 import re
+import string
+import time
 import unittest
 
+from StringIO import StringIO
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from mockito import mock, when, verify, unstub, any as any_value
 
+class LRUCache (object):
+    """
+        A bounded mapping that evicts the least recently used entry once it
+        holds more than size entries. Counts hits, misses and evictions.
+    """
+    def __init__ (self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get (self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put (self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear (self):
+        self.entries.clear()
+
+    def __len__ (self):
+        return len(self.entries)
+
 class AlienLanguage (object):
-    def __init__ (self, parser, dictionary):
+    def __init__ (self, parser, dictionary, engine=None, cache_size=0):
         self.parser = parser
+        self.engine_class = engine
+        self.cache = LRUCache(cache_size) if cache_size else None
         self.dictionary = dictionary
+    
+    @property
+    def dictionary (self):
+        return self._dictionary
+
+    @dictionary.setter
+    def dictionary (self, dictionary):
+        """
+            Replaces the dictionary. The dictionary is kept as a tuple so it
+            can only change through this setter (or add_words), which
+            rebuilds the engine and invalidates cached results.
+        """
+        self._dictionary = tuple(dictionary)
+        self._words = frozenset(self._dictionary)
+        self.engine = None
+        if self.engine_class:
+            self.engine = self.engine_class(self._dictionary)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def add_words (self, words):
+        self.dictionary = self._dictionary + tuple(words)
         
-    def determine_words (self, expression):
-        potential_words = self.parser.find_potential_words(expression)
+    def determine_words (self, expression, limit=None, count_only=False):
+        """
+            Returns the dictionary words matching the expression. When limit
+            is given at most that many words are returned; when count_only is
+            set only the number of matching words is returned. Both stream
+            the potential words instead of building all of them at once.
+        """
+        if self.cache is None:
+            return self._determine_words(expression, limit, count_only)
         
-        return [word for word in potential_words if word in self.dictionary]
+        key = (expression, limit, count_only)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._determine_words(expression, limit, count_only)
+            self.cache.put(key, result if count_only else tuple(result))
+            return result
+        return result if count_only else list(result)
+
+    def _determine_words (self, expression, limit, count_only):
+        if self.engine:
+            tokens = self.parser.tokenizer.tokenize(expression)
+            if count_only and limit is None:
+                return self.engine.count_words(tokens)
+            words = self.engine.determine_words(tokens)
+        elif limit is None and not count_only:
+            potential_words = self.parser.find_potential_words(expression)
+            
+            return [word for word in potential_words 
+                    if word in self._words]
+        else:
+            potential_words = self.parser.iterate_potential_words(expression)
+            words = (word for word in potential_words 
+                     if word in self._words)
+
+        if limit is not None:
+            words = itertools.islice(words, limit)
+        if count_only:
+            return sum(1 for word in words)
+        return list(words)
+
+class AbstractAlienLanguageEngine (object):
+    """
+        An engine matches a list of tokens against the dictionary without
+        expanding every potential word first. Engines must return the words
+        in the same order (and with the same multiplicity) as expanding the
+        tokens with AlienLanguageParser would.
+    """
+    def __init__ (self, dictionary):
+        self.dictionary = dictionary
+
+    def determine_words (self, tokens):
+        raise TypeError('Not implemented')
+
+    def count_words (self, tokens):
+        return len(self.determine_words(tokens))
+
+    def order_like_expansion (self, tokens, words):
+        """
+            Orders matching words the way expanding the tokens would produce
+            them and repeats words an alternation lists more than once.
+        """
+        positions = []
+        for token in tokens:
+            variations = token.get_possible_variations()
+            if len(variations) == 1:
+                positions.extend({character: [0]} 
+                                 for character in variations[0])
+                continue
+            indices = {}
+            for index, variation in enumerate(variations):
+                indices.setdefault(variation, []).append(index)
+            positions.append(indices)
+
+        ranked = []
+        for word in words:
+            for ranking in itertools.product(*[positions[i][character] 
+                                               for i, character 
+                                               in enumerate(word)]):
+                ranked.append((ranking, word))
+        ranked.sort()
+        return [word for (ranking, word) in ranked]
+
+class TrieAlienLanguageEngine (AbstractAlienLanguageEngine):
+    """
+        Stores the dictionary as a trie and walks the tokens through it,
+        dropping a branch as soon as its prefix is not part of any word.
+    """
+    WORD = None
+
+    def __init__ (self, dictionary):
+        AbstractAlienLanguageEngine.__init__(self, dictionary)
+        self.root = {}
+        for word in dictionary:
+            node = self.root
+            for character in word:
+                node = node.setdefault(character, {})
+            node[TrieAlienLanguageEngine.WORD] = word
+
+    def determine_words (self, tokens):
+        nodes = [self.root]
+        for token in tokens:
+            variations = token.get_possible_variations()
+            next_nodes = []
+            for node in nodes:
+                for variation in variations:
+                    child = node
+                    for character in variation:
+                        child = child.get(character)
+                        if child is None:
+                            break
+                    if child is not None:
+                        next_nodes.append(child)
+            if not next_nodes:
+                return []
+            nodes = next_nodes
+
+        return [node[TrieAlienLanguageEngine.WORD] for node in nodes
+                if TrieAlienLanguageEngine.WORD in node]
+
+class BitmaskAlienLanguageEngine (AbstractAlienLanguageEngine):
+    """
+        Turns an expression into one 26 bit letter mask per position and
+        checks every dictionary word of the same length against them. When
+        numpy is available all words are checked in one vectorized pass.
+    """
+    def __init__ (self, dictionary):
+        AbstractAlienLanguageEngine.__init__(self, dictionary)
+        self.words = {}
+        for word in set(dictionary):
+            letters = [ord(character) - ord('a') for character in word]
+            if all(0 <= letter < 26 for letter in letters):
+                self.words.setdefault(len(word), []).append((word, letters))
+
+        self.letters = {}
+        for length, words in self.words.items():
+            words.sort()
+            letters = [letters for (word, letters) in words]
+            if numpy:
+                letters = numpy.array(letters, dtype=numpy.uint8)
+                letters.shape = (len(words), length)
+            self.letters[length] = letters
+            self.words[length] = [word for (word, letters) in words]
+
+    def determine_words (self, tokens):
+        masks = []
+        for token in tokens:
+            masks.extend(token.get_position_masks())
+
+        words = self.words.get(len(masks))
+        if not words:
+            return []
+        letters = self.letters[len(masks)]
+
+        if numpy:
+            hits = (numpy.array(masks, dtype=numpy.uint32) >> letters) & 1
+            matches = [words[i] for i in numpy.flatnonzero(hits.all(axis=1))]
+        else:
+            matches = [word for (word, indices) in zip(words, letters)
+                       if all(mask >> index & 1 
+                              for (mask, index) in zip(masks, indices))]
+
+        return self.order_like_expansion(tokens, matches)
     
+class RegexAlienLanguageEngine (AbstractAlienLanguageEngine):
+    """
+        Compiles the tokens into one regular expression, turning (ab)c into
+        [ab]c, and scans the newline joined dictionary with it in one pass.
+    """
+    def __init__ (self, dictionary):
+        AbstractAlienLanguageEngine.__init__(self, dictionary)
+        self.text = '\n'.join(sorted(set(word for word in dictionary 
+                                          if '\n' not in word)))
+
+    def compile (self, tokens):
+        pattern = []
+        for token in tokens:
+            variations = token.get_possible_variations()
+            if len(variations) == 1:
+                pattern.append(re.escape(variations[0]))
+            else:
+                pattern.append('[%s]' % ''.join(re.escape(variation) 
+                                                for variation in variations))
+        return re.compile('^%s$' % ''.join(pattern), re.MULTILINE)
+
+    def determine_words (self, tokens):
+        matches = [match.group() 
+                   for match in self.compile(tokens).finditer(self.text)]
+        return self.order_like_expansion(tokens, matches)
+
+class IndexedAlienLanguageEngine (AbstractAlienLanguageEngine):
+    """
+        Keeps an inverted index from (position, letter) to the set of words
+        having that letter at that position, stored as a bitset of word ids
+        in a Python int. A query ORs the bitsets within each position's
+        alternation and ANDs them across positions, so no word is looked at
+        individually.
+    """
+    def __init__ (self, dictionary):
+        AbstractAlienLanguageEngine.__init__(self, dictionary)
+        self.words = {}
+        for word in sorted(set(dictionary)):
+            if all('a' <= character <= 'z' for character in word):
+                self.words.setdefault(len(word), []).append(word)
+
+        self.index = {}
+        for length, words in self.words.items():
+            index = [[0] * 26 for position in range(length)]
+            for (word_id, word) in enumerate(words):
+                bit = 1 << word_id
+                for (position, character) in enumerate(word):
+                    index[position][ord(character) - ord('a')] |= bit
+            self.index[length] = index
+
+    def find_word_ids (self, tokens):
+        masks = []
+        for token in tokens:
+            masks.extend(token.get_position_masks())
+
+        index = self.index.get(len(masks))
+        if not index:
+            return 0
+
+        result = -1
+        for (position, mask) in enumerate(masks):
+            letters = index[position]
+            matching = 0
+            while mask:
+                lowest = mask & -mask
+                matching |= letters[lowest.bit_length() - 1]
+                mask ^= lowest
+            result &= matching
+            if not result:
+                break
+        return result
+
+    def determine_words (self, tokens):
+        word_ids = self.find_word_ids(tokens)
+        if not word_ids:
+            return []
+        
+        words = self.words[sum(len(token.get_position_masks()) 
+                               for token in tokens)]
+        matches = []
+        while word_ids:
+            lowest = word_ids & -word_ids
+            matches.append(words[lowest.bit_length() - 1])
+            word_ids ^= lowest
+        return self.order_like_expansion(tokens, matches)
+
+    def count_words (self, tokens):
+        for token in tokens:
+            variations = token.get_possible_variations()
+            if len(variations) > 1 and len(set(variations)) < len(variations):
+                return len(self.determine_words(tokens))
+        return bin(self.find_word_ids(tokens)).count('1')
+
 class AbstractAlienLanguageToken (object):
+    """
+        Tokens are immutable, hashable values. Their variations and position
+        masks are computed once when the token is created and shared by
+        every caller afterwards.
+    """
+    __slots__ = ('value', 'variations', 'position_masks')
+
     def __init__ (self, value):
-        self.value = value
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'variations', self.compute_variations())
+        object.__setattr__(self, 'position_masks', 
+                           self.compute_position_masks())
     
-    def get_possible_variations (self):
+    def compute_variations (self):
         raise TypeError('Not implemented')
+
+    def compute_position_masks (self):
+        raise TypeError('Not implemented')
+
+    def get_possible_variations (self):
+        return self.variations
+
+    def get_position_masks (self):
+        return self.position_masks
     
+    @staticmethod
+    def letter_mask (character):
+        index = ord(character) - ord('a')
+        if 0 <= index < 26:
+            return 1 << index
+        return 0
+
     def __repr__ (self):
         return str(self)
     
     def __eq__ (self, other):
-        return self.value == other.value and self.__class__ == other.__class__
+        return self.__class__ == other.__class__ and self.value == other.value
     
+    def __ne__ (self, other):
+        return not self == other
+
+    def __hash__ (self):
+        return hash((self.__class__, self.value))
+
+    def __setattr__ (self, name, value):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __delattr__ (self, name):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __reduce__ (self):
+        return (self.__class__, (self.value,))
+
 class LiteralAlienLanguageToken (AbstractAlienLanguageToken):
-    def get_possible_variations (self):
-        return [self.value]
+    __slots__ = ()
+
+    def compute_variations (self):
+        return (self.value,)
     
+    def compute_position_masks (self):
+        return tuple(AbstractAlienLanguageToken.letter_mask(character) 
+                     for character in self.value)
+
     def __str__ (self):
         return self.value
 
 class AlternatingAlienLanguageToken (AbstractAlienLanguageToken):
-    def get_possible_variations (self):
-        return [character for character in self.value]
+    __slots__ = ()
+
+    def compute_variations (self):
+        return tuple(self.value)
+
+    def compute_position_masks (self):
+        mask = 0
+        for character in self.value:
+            mask |= AbstractAlienLanguageToken.letter_mask(character)
+        return (mask,)
 
     def __str__ (self):
         return '[%s]' % self.value
@@ -52,7 +430,20 @@ class AlternatingAlienLanguageToken (AbstractAlienLanguageToken):
 class AlienLanguageTokenizer (object):
     TOKEN_PATTERN = re.compile(r'(\([a-z]+\))')
     
+    def __init__ (self, cache_size=0):
+        self.cache = LRUCache(cache_size) if cache_size else None
+
     def tokenize (self, expression):
+        if self.cache is None:
+            return self._tokenize(expression)
+        
+        tokens = self.cache.get(expression)
+        if tokens is None:
+            tokens = tuple(self._tokenize(expression))
+            self.cache.put(expression, tokens)
+        return list(tokens)
+
+    def _tokenize (self, expression):
         match = AlienLanguageTokenizer.TOKEN_PATTERN.split(expression)
         
         result = []
@@ -77,7 +468,7 @@ class AlienLanguageParser (object):
         for token in tokens:
             variations = token.get_possible_variations()
             if not result:
-                result = variations
+                result = list(variations)
             else:
                 result_multiplied = []
                 for intermediate in result:
@@ -86,6 +477,46 @@ class AlienLanguageParser (object):
                 result = result_multiplied
         return result
 
+    def iterate_potential_words (self, expression):
+        """
+            Yields the same words as find_potential_words in the same order
+            but one at a time.
+        """
+        tokens = self.tokenizer.tokenize(expression)
+        variations = [token.get_possible_variations() for token in tokens]
+        
+        for combination in itertools.product(*variations):
+            yield ''.join(combination)
+
+
+class AlienLanguageTokenTests (unittest.TestCase):
+    def test_should_precompute_variations (self):
+        token = AlternatingAlienLanguageToken('abc')
+        
+        self.assertEquals(('a', 'b', 'c'), token.get_possible_variations())
+        self.assertTrue(token.get_possible_variations() is 
+                        token.get_possible_variations())
+
+    def test_should_precompute_position_masks (self):
+        self.assertEquals((0b111,), 
+                          AlternatingAlienLanguageToken('abc')
+                          .get_position_masks())
+        self.assertEquals((0b1, 0b10), 
+                          LiteralAlienLanguageToken('ab').get_position_masks())
+
+    def test_should_be_immutable (self):
+        token = LiteralAlienLanguageToken('abc')
+        
+        self.assertRaises(AttributeError, setattr, token, 'value', 'cba')
+        self.assertRaises(AttributeError, delattr, token, 'value')
+        self.assertFalse(hasattr(token, '__dict__'))
+
+    def test_should_be_hashable (self):
+        tokens = set([LiteralAlienLanguageToken('ab'), 
+                      LiteralAlienLanguageToken('ab'),
+                      AlternatingAlienLanguageToken('ab')])
+        
+        self.assertEquals(2, len(tokens))
 
 class AlienLanguageTokenizerTests (unittest.TestCase):
     def test_should_tokenize_literal (self):
@@ -106,6 +537,38 @@ class AlienLanguageTokenizerTests (unittest.TestCase):
         self.assertEquals(expected, 
                           AlienLanguageTokenizer().tokenize(expression))
 
+    def test_should_return_cached_tokens (self):
+        tokenizer = AlienLanguageTokenizer(cache_size=2)
+        tokenizer.tokenize('(ab)c')
+        tokens = tokenizer.tokenize('(ab)c')
+        
+        self.assertEquals([AlternatingAlienLanguageToken('ab'), 
+                           LiteralAlienLanguageToken('c')], tokens)
+        self.assertEquals(1, tokenizer.cache.hits)
+        self.assertEquals(1, tokenizer.cache.misses)
+
+class LRUCacheTests (unittest.TestCase):
+    def test_should_count_hits_and_misses (self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        
+        self.assertEquals(1, cache.get('a'))
+        self.assertEquals(None, cache.get('b'))
+        self.assertEquals(1, cache.hits)
+        self.assertEquals(1, cache.misses)
+
+    def test_should_evict_least_recently_used_entry (self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        
+        self.assertEquals(1, cache.get('a'))
+        self.assertEquals(None, cache.get('b'))
+        self.assertEquals(1, cache.evictions)
+        self.assertEquals(2, len(cache))
+
 class AlienLanguageParserAcceptanceTests (unittest.TestCase):
     def tearDown (self):
         unittest.TestCase.tearDown(self)
@@ -132,6 +595,14 @@ class AlienLanguageParserAcceptanceTests (unittest.TestCase):
         self.assertEquals(['aaa', 'aab', 'baa', 'bab'], potential_words)
 
         verify(tokenizer_mock).tokenize('(ab)a(ab)')
+
+    def test_should_iterate_words_in_same_order (self):
+        parser = AlienLanguageParser(AlienLanguageTokenizer())
+        expression = '(ab)a(ab)'
+        potential_words = parser.iterate_potential_words(expression)
+
+        self.assertEquals(parser.find_potential_words(expression),
+                          list(potential_words))
     
 class AlienLanguageAcceptanceTests (unittest.TestCase):
     def tearDown (self):
@@ -178,26 +649,356 @@ class AlienLanguageIntegrationTests (unittest.TestCase):
         actual_words = language.determine_words(expression)
         self.assertEquals(expected_words, actual_words)
 
+    def test_should_determine_correct_words_when_engine_is_given (self):
+        expression = '(ab)(bc)(ca)'
+        language_words = 'abc bca dac dbc cba'.split()
+        expected_words = 'abc bca'.split()
+        
+        tokenizer = AlienLanguageTokenizer()
+        parser = AlienLanguageParser(tokenizer)
+        language = AlienLanguage(parser, language_words, 
+                                 TrieAlienLanguageEngine)
+        actual_words = language.determine_words(expression)
+        self.assertEquals(expected_words, actual_words)
+
+    def test_should_limit_number_of_words (self):
+        expression = '(ab)(bc)(ca)'
+        language_words = 'abc bca dac dbc cba'.split()
+        
+        language = AlienLanguage(AlienLanguageParser(AlienLanguageTokenizer()),
+                                 language_words)
+        self.assertEquals(['abc'], language.determine_words(expression, 
+                                                            limit=1))
+
+    def test_should_count_words (self):
+        expression = '(ab)(bc)(ca)'
+        language_words = 'abc bca dac dbc cba'.split()
+        
+        language = AlienLanguage(AlienLanguageParser(AlienLanguageTokenizer()),
+                                 language_words)
+        self.assertEquals(2, language.determine_words(expression, 
+                                                      count_only=True))
+
+    def test_should_count_words_when_engine_is_given (self):
+        expression = '(ab)(bc)(ca)'
+        language_words = 'abc bca dac dbc cba'.split()
+        
+        language = AlienLanguage(AlienLanguageParser(AlienLanguageTokenizer()),
+                                 language_words, TrieAlienLanguageEngine)
+        self.assertEquals(1, language.determine_words(expression, limit=1,
+                                                      count_only=True))
+
+    def test_should_return_cached_words (self):
+        expression = '(ab)(bc)(ca)'
+        language_words = 'abc bca dac dbc cba'.split()
+        
+        language = AlienLanguage(AlienLanguageParser(AlienLanguageTokenizer()),
+                                 language_words, cache_size=4)
+        language.determine_words(expression)
+        
+        self.assertEquals(['abc', 'bca'], language.determine_words(expression))
+        self.assertEquals(1, language.cache.hits)
+
+    def test_should_invalidate_cached_words_when_dictionary_changes (self):
+        expression = '(ab)(bc)(ca)'
+        language_words = 'abc bca dac dbc cba'.split()
+        
+        language = AlienLanguage(AlienLanguageParser(AlienLanguageTokenizer()),
+                                 language_words, TrieAlienLanguageEngine, 
+                                 cache_size=4)
+        language.determine_words(expression)
+        language.add_words(['bba'])
+        
+        self.assertEquals(['abc', 'bba', 'bca'], 
+                          language.determine_words(expression))
+        self.assertEquals(0, language.cache.hits)
+
+        language.dictionary = ['aba']
+        
+        self.assertEquals(1, language.determine_words(expression, 
+                                                      count_only=True))
+
+class TrieAlienLanguageEngineTests (unittest.TestCase):
+    ENGINE = TrieAlienLanguageEngine
+
+    def determine_words (self, dictionary, expression):
+        tokens = AlienLanguageTokenizer().tokenize(expression)
+        return self.ENGINE(dictionary).determine_words(tokens)
+
+    def count_words (self, dictionary, expression):
+        tokens = AlienLanguageTokenizer().tokenize(expression)
+        return self.ENGINE(dictionary).count_words(tokens)
+
+    def test_should_find_words_in_expansion_order (self):
+        dictionary = 'abc bca dac dbc cba'.split()
+        self.assertEquals(['dac', 'dbc', 'abc'], 
+                          self.determine_words(dictionary, '(dab)(ab)c'))
+
+    def test_should_find_words_for_literal_tokens (self):
+        dictionary = 'abc bca dac dbc cba'.split()
+        self.assertEquals(['dac', 'dbc'], 
+                          self.determine_words(dictionary, 'd(ab)c'))
+
+    def test_should_find_no_words_when_prefix_is_unknown (self):
+        dictionary = 'abc bca dac dbc cba'.split()
+        self.assertEquals([], self.determine_words(dictionary, '(zyx)bc'))
+
+    def test_should_not_find_prefixes_of_words (self):
+        dictionary = 'abc bca'.split()
+        self.assertEquals([], self.determine_words(dictionary, 'ab'))
+
+    def test_should_keep_duplicates_like_expansion (self):
+        dictionary = 'abc bca'.split()
+        self.assertEquals(['abc', 'abc'], 
+                          self.determine_words(dictionary, '(aa)bc'))
+        self.assertEquals(['abc', 'bca', 'abc'], 
+                          self.determine_words(dictionary, '(aba)(bc)(ca)'))
+        self.assertEquals(2, self.count_words(dictionary, '(aa)bc'))
+
+    def test_should_match_long_expressions_without_expansion (self):
+        alternation = '(%s)' % 'abcdefghijklmnopqrstuvwxyz'
+        dictionary = ['abcdefghijklmno', 'zyxwvutsrqponml', 'aaaaaaaaaaaaaaa']
+        self.assertEquals(['aaaaaaaaaaaaaaa', 'abcdefghijklmno', 
+                           'zyxwvutsrqponml'],
+                          self.determine_words(dictionary, alternation * 15))
+
+    def test_should_agree_with_expansion (self):
+        parser = AlienLanguageParser(AlienLanguageTokenizer())
+        for (dictionary, expressions) in [
+                ('abc bca dac dbc cba aaa ccc bab'.split(), 
+                 ['(abcd)(abc)(abc)', '(cb)(ab)(ab)', 'a(cab)(ba)']),
+                generate_benchmark_input(words=200, length=4, expressions=20),
+                generate_benchmark_input(words=300, length=2, expressions=50,
+                                         alternatives=4, repeats=True)]:
+            expanding = AlienLanguage(parser, dictionary)
+            matching = AlienLanguage(parser, dictionary, self.ENGINE)
+            for expression in expressions:
+                expected = expanding.determine_words(expression)
+                self.assertEquals(expected, 
+                                  matching.determine_words(expression))
+                self.assertEquals(len(expected), 
+                                  matching.determine_words(expression, 
+                                                           count_only=True))
+
+class BitmaskAlienLanguageEngineTests (TrieAlienLanguageEngineTests):
+    ENGINE = BitmaskAlienLanguageEngine
+
+class RegexAlienLanguageEngineTests (TrieAlienLanguageEngineTests):
+    ENGINE = RegexAlienLanguageEngine
+
+    def test_should_compile_alternations_to_character_classes (self):
+        tokens = AlienLanguageTokenizer().tokenize('(ab)c')
+        pattern = RegexAlienLanguageEngine([]).compile(tokens)
+        
+        self.assertEquals('^[ab]c$', pattern.pattern)
+
+class IndexedAlienLanguageEngineTests (TrieAlienLanguageEngineTests):
+    ENGINE = IndexedAlienLanguageEngine
+
+    def test_should_count_words_from_bitset (self):
+        dictionary = 'abc bca dac dbc cba'.split()
+        self.assertEquals(3, self.count_words(dictionary, '(dab)(ab)c'))
+        self.assertEquals(0, self.count_words(dictionary, '(zyx)bc'))
+
+class BenchmarkEnginesTests (unittest.TestCase):
+    def test_should_time_every_engine (self):
+        (dictionary, expressions) = generate_benchmark_input(
+            words=50, length=3, expressions=5)
+        results = benchmark_engines(dictionary, expressions, repeat=1)
+        
+        self.assertEquals(sorted(ENGINES), [name for (name, seconds) 
+                                            in results])
+
+class CountWordsTests (unittest.TestCase):
+    DICTIONARY = 'abc bca dac dbc cba'.split()
+    EXPRESSIONS = ['(ab)(bc)(ca)', 'abc', '(abc)(abc)(abc)', '(zyx)bc'] * 5
+    
+    def test_should_count_words_for_each_expression (self):
+        self.assertEquals([2, 1, 3, 0] * 5, 
+                          list(count_words(CountWordsTests.DICTIONARY, 
+                                           CountWordsTests.EXPRESSIONS)))
 
-def handle_google_code_jam_file (file_name):
-    lines = open(file_name, 'r').readlines()
-    (l, d, n) = map(lambda (x): int(x), lines[0].split())
-    dictionary = map(lambda (x): x.strip(), lines[1:d + 1])
-    expressions = map(lambda (x): x.strip(), lines[d + 1:])
+    def test_should_count_words_in_order_when_using_workers (self):
+        self.assertEquals([2, 1, 3, 0] * 5, 
+                          list(count_words(CountWordsTests.DICTIONARY, 
+                                           CountWordsTests.EXPRESSIONS,
+                                           workers=2, chunk_size=3)))
 
-    language = AlienLanguage(AlienLanguageParser(AlienLanguageTokenizer()), 
-                             dictionary)
+class ReadGoogleCodeJamInputTests (unittest.TestCase):
+    def test_should_read_dictionary_and_expressions (self):
+        stream = StringIO('3 2 2\nabc\nbca\n(ab)bc\nabc\n')
+        (dictionary, expressions) = read_google_code_jam_input(stream)
+        
+        self.assertEquals(['abc', 'bca'], dictionary)
+        self.assertEquals(['(ab)bc', 'abc'], list(expressions))
+
+    def test_should_read_expressions_lazily (self):
+        stream = StringIO('3 1 2\nabc\n(ab)bc\nabc\n')
+        (dictionary, expressions) = read_google_code_jam_input(stream)
+        
+        self.assertEquals('(ab)bc', next(expressions))
+        self.assertEquals('abc\n', stream.readline())
+
+    def test_should_read_no_more_than_announced_expressions (self):
+        stream = StringIO('3 1 1\nabc\n(ab)bc\nabc\n')
+        (dictionary, expressions) = read_google_code_jam_input(stream)
+        
+        self.assertEquals(['(ab)bc'], list(expressions))
+
+
+ENGINES = {
+    'expand': None,
+    'trie': TrieAlienLanguageEngine,
+    'bitmask': BitmaskAlienLanguageEngine,
+    'regex': RegexAlienLanguageEngine,
+    'index': IndexedAlienLanguageEngine,
+}
+
+_worker_language = None
+
+def _initialize_worker (dictionary, engine, cache_size):
+    global _worker_language
+    _worker_language = AlienLanguage(
+        AlienLanguageParser(AlienLanguageTokenizer(cache_size)), dictionary, 
+        engine, cache_size)
+
+def _count_words_in_worker (expression):
+    return _worker_language.determine_words(expression, count_only=True)
+
+def count_words (dictionary, expressions, engine=TrieAlienLanguageEngine,
+                 workers=1, chunk_size=16, cache_size=0):
+    """
+        Yields the number of matching words for each expression in order.
+        With more than one worker the expressions are sent to a process pool
+        in chunks; every worker builds the dictionary structure only once.
+    """
+    if workers <= 1:
+        language = AlienLanguage(
+            AlienLanguageParser(AlienLanguageTokenizer(cache_size)), 
+            dictionary, engine, cache_size)
+        for expression in expressions:
+            yield language.determine_words(expression, count_only=True)
+        return
+
+    pool = multiprocessing.Pool(workers, _initialize_worker, 
+                                (dictionary, engine, cache_size))
+    expressions = iter(expressions)
+    batch_size = workers * chunk_size * 4
+    try:
+        while True:
+            # Pool.imap consumes its whole input up front, so expressions are
+            # handed over in bounded batches to keep memory independent of N.
+            batch = list(itertools.islice(expressions, batch_size))
+            if not batch:
+                break
+            for count in pool.imap(_count_words_in_worker, batch, chunk_size):
+                yield count
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def generate_benchmark_input (words=1000, length=6, expressions=50, 
+                              alternatives=3, seed=0, repeats=False):
+    """
+        Generates a random dictionary and expressions that alternate between
+        the given number of letters at every position. Every expression
+        matches at least one dictionary word. With repeats, alternations 
+        list some of their letters more than once, in random order.
+    """
+    generator = random.Random(seed)
+    letters = string.ascii_lowercase
+    dictionary = [''.join(generator.choice(letters) for i in range(length))
+                  for j in range(words)]
+    
+    result = []
+    for i in range(expressions):
+        expression = ''
+        for character in generator.choice(dictionary):
+            alternation = set(generator.sample(letters, alternatives - 1))
+            alternation.add(character)
+            alternation = sorted(alternation)
+            if repeats:
+                alternation += [generator.choice(alternation) 
+                                for j in range(generator.randint(0, 2))]
+                generator.shuffle(alternation)
+            expression += '(%s)' % ''.join(alternation)
+        result.append(expression)
+    return (dictionary, result)
+
+def benchmark_engines (dictionary, expressions, engines=ENGINES, repeat=3):
+    """
+        Determines the words of all expressions with every engine and
+        returns (name, seconds) pairs with the best time of repeat runs.
+        Raises an AssertionError when an engine disagrees with the others.
+    """
+    results = []
+    expected = None
+    for name in sorted(engines):
+        language = AlienLanguage(AlienLanguageParser(AlienLanguageTokenizer()),
+                                 dictionary, engines[name])
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            words = [language.determine_words(expression) 
+                     for expression in expressions]
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        
+        if expected is None:
+            expected = words
+        elif words != expected:
+            raise AssertionError('Engine %s disagrees' % name)
+        results.append((name, best))
+    return results
+
+def read_google_code_jam_input (stream):
+    """
+        Reads the "L D N" header and the D dictionary words from stream.
+        Returns the dictionary and a generator reading the N expressions one
+        at a time.
+    """
+    (l, d, n) = map(lambda (x): int(x), stream.readline().split())
+    dictionary = [stream.readline().strip() for i in range(d)]
+    expressions = (line.strip() for line in itertools.islice(stream, n))
     
-    count = 1
-    for expression in expressions:
-        print "Case #%d: %d" % (count, 
-                                len(language.determine_words(expression)))
-        count += 1    
+    return (dictionary, expressions)
+
+def handle_google_code_jam_file (file_name, engine=TrieAlienLanguageEngine,
+                                 workers=1, cache_size=0):
+    with open(file_name, 'r') as stream:
+        (dictionary, expressions) = read_google_code_jam_input(stream)
+        
+        count = 1
+        for words in count_words(dictionary, expressions, engine, workers,
+                                 cache_size=cache_size):
+            print "Case #%d: %d" % (count, words)
+            count += 1    
     
 if __name__ == '__main__':
+    import argparse
     import sys
-    if len(sys.argv) != 2:
-        sys.stderr.write("Usage: %s inputfile" % sys.argv[0])
-        sys.exit(1)
     
-    handle_google_code_jam_file(sys.argv[1])    
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('inputfile', nargs='?')
+    argument_parser.add_argument('--engine', choices=sorted(ENGINES), 
+                                 default='trie')
+    argument_parser.add_argument('--workers', type=int, default=1)
+    argument_parser.add_argument('--cache-size', type=int, default=0)
+    argument_parser.add_argument('--benchmark', action='store_true')
+    arguments = argument_parser.parse_args()
+    
+    if arguments.benchmark:
+        (dictionary, expressions) = generate_benchmark_input()
+        for (name, seconds) in benchmark_engines(dictionary, expressions):
+            print "%-8s %.4fs" % (name, seconds)
+        sys.exit(0)
+    if not arguments.inputfile:
+        argument_parser.error('inputfile is required')
+
+    handle_google_code_jam_file(arguments.inputfile, 
+                                ENGINES[arguments.engine], 
+                                arguments.workers, 
+                                arguments.cache_size)    
@@ -9,8 +9,18 @@
     You can find an introduction here: 
         http://en.wikipedia.org/wiki/Bowling#Scoring
 """
+import os
+import random
+import struct
+import tempfile
+import time
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Frame (object):
     def __init__(self, frameNumber):
         self._frameNumber = frameNumber
@@ -82,7 +92,15 @@ class Frame (object):
 
         return self.pinsFirstRoll + self.pinsSecondRoll
 
-    
+
+def scoreLastFrameWithThirdRoll (first, second, third):
+    """
+        Returns the score of a complete last frame with three rolls. Works
+        on numbers as well as on numpy arrays of rolls.
+    """
+    return first + second + third + \
+        (first == 10) * (second + third) + (second == 10) * third
+
 class LastFrame (Frame):
     def __init__ (self, frameNumber):
         Frame.__init__(self, frameNumber)
@@ -103,14 +121,9 @@ class LastFrame (Frame):
         if not self.hasThirdRoll:
             return Frame.calculateScore(self, None, None) 
         
-        result = self.pinsFirstRoll
-        if self.pinsFirstRoll == 10:
-            result += self.pinsSecondRoll + self.pinsThirdRoll
-        result += self.pinsSecondRoll
-        if self.pinsSecondRoll == 10:
-            result += self.pinsThirdRoll
-        result += self.pinsThirdRoll
-        return result
+        return scoreLastFrameWithThirdRoll(self.pinsFirstRoll, 
+                                           self.pinsSecondRoll, 
+                                           self.pinsThirdRoll)
     
     @property
     def roll (self):
@@ -136,6 +149,9 @@ class LastFrame (Frame):
 class BowlingGame (object):
     def __init__(self):
         self._frames = [Frame(1)]
+        self._settledFrames = 0
+        self._settledScore = 0
+        self._score = 0
     
     def hitPins (self, pins = 0):
         self._frames[-1].hitPins(pins)
@@ -144,20 +160,39 @@ class BowlingGame (object):
                 self._frames.append(Frame(len(self._frames) + 1))
             else:
                 self._frames.append(LastFrame(10))
+        self._updateScore()
     
+    def _updateScore (self):
+        """
+            A frame's score only depends on the frame itself and the two 
+            frames following it. Once a third frame follows, the score of a 
+            frame is settled and added to the running total, so only the 
+            last three frames are recalculated after each roll.
+        """
+        while len(self._frames) - self._settledFrames > 3:
+            self._settledScore += self._calculateFrameScore(self._settledFrames)
+            self._settledFrames += 1
+        
+        self._score = self._settledScore
+        for i in range(self._settledFrames, len(self._frames)):
+            self._score += self._calculateFrameScore(i)
+    
+    def _calculateFrameScore (self, i):
+        frame = self._frames[i]
+        framePlusOne = \
+            self._frames[i + 1] if i < len(self._frames) - 1 else None
+        framePlusTwo = \
+            self._frames[i + 2] if i < len(self._frames) - 2 else None
+        
+        return frame.calculateScore(framePlusOne, framePlusTwo)
+
+    def _calculateScore (self):
+        return sum(self._calculateFrameScore(i) 
+                   for i in range(0, len(self._frames)))
+
     @property
     def score (self):
-        score = 0
-        for i in range(0, len(self._frames)):
-            frame = self._frames[i]
-            framePlusOne = \
-                self._frames[i + 1] if i < len(self._frames) - 1 else None
-            framePlusTwo = \
-                self._frames[i + 2] if i < len(self._frames) - 2 else None
-            
-            score += frame.calculateScore(framePlusOne, framePlusTwo)
-
-        return score
+        return self._score
     
     @property
     def frame (self):
@@ -167,6 +202,507 @@ class BowlingGame (object):
     def roll (self):
         return self._frames[-1].roll
 
+class CompactBowlingGame (object):
+    """
+        A BowlingGame that stores all rolls in one fixed size bytearray plus
+        a small cursor instead of Frame objects. It offers the same hitPins, 
+        frame, roll and score API and scores exactly like BowlingGame, while 
+        taking an order of magnitude less memory. Once the game is over 
+        _roll is 0.
+    """
+    __slots__ = ('_rolls', '_count', '_frame', '_roll', '_score')
+    
+    MAX_ROLLS = 21
+
+    def __init__ (self):
+        self._rolls = bytearray(CompactBowlingGame.MAX_ROLLS)
+        self._count = 0
+        self._frame = 1
+        self._roll = 1
+        self._score = 0
+
+    @classmethod
+    def fromRolls (cls, rolls):
+        """
+            Restores a game from the pins of all rolls made so far, scoring
+            it only once at the end.
+        """
+        rolls = bytearray(rolls)
+        count = len(rolls)
+        
+        (frame, position) = (1, 0)
+        while frame < 10 and position < count:
+            position += 1 if rolls[position] == 10 else 2
+            if position > count:
+                break
+            frame += 1
+        
+        if frame < 10:
+            roll = 2 if position > count else 1
+        else:
+            made = count - position
+            rollsInLastFrame = 3 if made < 2 or \
+                rolls[position] + rolls[position + 1] >= 10 else 2
+            if made > rollsInLastFrame:
+                raise ValueError('Game is over')
+            roll = 0 if made == rollsInLastFrame else made + 1
+        
+        game = cls()
+        game._rolls[:count] = rolls
+        game._count = count
+        game._frame = frame
+        game._roll = roll
+        game._score = sum(scoreFrames(game._rolls, count))
+        return game
+
+    @property
+    def rolls (self):
+        return str(self._rolls[:self._count])
+
+    def hitPins (self, pins = 0):
+        self._addRoll(pins)
+        self._score = sum(scoreFrames(self._rolls, self._count))
+
+    def _addRoll (self, pins):
+        if self.over:
+            raise ValueError('Game is over')
+        self._rolls[self._count] = pins
+        self._count += 1
+        
+        if self._frame < 10:
+            if self._roll == 1 and pins < 10:
+                self._roll = 2
+            else:
+                self._frame += 1
+                self._roll = 1
+        elif self._roll == 1:
+            self._roll = 2
+        elif self._roll == 2 and self._hasThirdRoll():
+            self._roll = 3
+        else:
+            self._roll = 0
+
+    def _hasThirdRoll (self):
+        first = self._rolls[self._count - 2]
+        return first == 10 or first + self._rolls[self._count - 1] == 10
+
+    @property
+    def score (self):
+        return self._score
+    
+    @property
+    def frame (self):
+        return self._frame
+    
+    @property
+    def roll (self):
+        return self._roll or 1
+
+    @property
+    def over (self):
+        return self._roll == 0
+
+class RollLog (object):
+    """
+        Append-only binary log of the rolls of many games. Every record is a
+        header (kind, game id, number of rolls) followed by one byte per 
+        roll. ROLLS records add rolls to a game, SNAPSHOT records replace the
+        rolls of a game. 
+        
+        Rolls are buffered per game and written as one ROLLS record when the
+        log is flushed, so a game costs a header per flush plus one byte per
+        roll. The log flushes itself every flushInterval rolls and whenever
+        a roll comes in flushSeconds after the last flush, which bounds the
+        rolls a crash can lose.
+        
+        A game that is over is written as a single SNAPSHOT record to an
+        append-only archive (fileName + '.archive') and dropped from memory.
+        Only its id is kept, so further rolls for it are rejected.
+        Every snapshotInterval rolls the log itself is compacted: a new file
+        holding one SNAPSHOT record per running game atomically replaces 
+        it. A snapshot therefore only costs as much as the running games, 
+        however long the venue's history gets.
+    """
+    HEADER = struct.Struct('<BIB')
+    ROLLS = 1
+    SNAPSHOT = 2
+
+    def __init__ (self, fileName, snapshotInterval=10000, flushInterval=100,
+                  flushSeconds=0.1):
+        self.fileName = fileName
+        self.archiveFileName = fileName + '.archive'
+        self.snapshotInterval = snapshotInterval
+        self.flushInterval = flushInterval
+        self.flushSeconds = flushSeconds
+        games = loadGames(fileName) if os.path.exists(fileName) else {}
+        self._games = dict((gameId, game) for (gameId, game) in games.items()
+                           if not game.over)
+        self._finishedGameIds = set(gameId for (gameId, game) 
+                                    in games.items() if game.over)
+        self._pending = {}
+        self._rollsSinceSnapshot = 0
+        self._rollsSinceFlush = 0
+        self._flushedAt = time.time()
+        self._stream = open(fileName, 'ab')
+        self._archive = open(self.archiveFileName, 'ab')
+
+    def hitPins (self, gameId, pins = 0):
+        if gameId in self._finishedGameIds:
+            raise ValueError('Game %d is over' % gameId)
+        game = self._games.get(gameId)
+        if game is None:
+            game = self._games[gameId] = CompactBowlingGame()
+        game._addRoll(pins)
+        
+        if game.over:
+            self._archive.write(RollLog.HEADER.pack(RollLog.SNAPSHOT, gameId,
+                                                    game._count))
+            self._archive.write(game.rolls)
+            self._archive.flush()
+            del self._games[gameId]
+            self._pending.pop(gameId, None)
+            self._finishedGameIds.add(gameId)
+        else:
+            self._pending.setdefault(gameId, bytearray()).append(pins)
+        
+        self._rollsSinceSnapshot += 1
+        self._rollsSinceFlush += 1
+        if self._rollsSinceSnapshot >= self.snapshotInterval:
+            self.snapshot()
+        elif self._rollsSinceFlush >= self.flushInterval or \
+                time.time() - self._flushedAt >= self.flushSeconds:
+            self.flush()
+
+    def flush (self):
+        for (gameId, rolls) in sorted(self._pending.items()):
+            self._stream.write(RollLog.HEADER.pack(RollLog.ROLLS, gameId, 
+                                                   len(rolls)))
+            self._stream.write(rolls)
+        self._stream.flush()
+        self._pending = {}
+        self._rollsSinceFlush = 0
+        self._flushedAt = time.time()
+
+    def snapshot (self):
+        temporaryFileName = self.fileName + '.tmp'
+        with open(temporaryFileName, 'wb') as stream:
+            for (gameId, game) in sorted(self._games.items()):
+                stream.write(RollLog.HEADER.pack(RollLog.SNAPSHOT, gameId, 
+                                                 game._count))
+                stream.write(game.rolls)
+            stream.flush()
+            os.fsync(stream.fileno())
+        
+        self._stream.close()
+        os.rename(temporaryFileName, self.fileName)
+        self._stream = open(self.fileName, 'ab')
+        self._pending = {}
+        self._rollsSinceSnapshot = 0
+        self._rollsSinceFlush = 0
+        self._flushedAt = time.time()
+
+    def close (self):
+        self.flush()
+        self._stream.close()
+        self._archive.close()
+
+def _readRollRecords (fileName, rolls):
+    with open(fileName, 'rb') as stream:
+        data = stream.read()
+    
+    position = 0
+    headerSize = RollLog.HEADER.size
+    while position + headerSize <= len(data):
+        (kind, gameId, count) = RollLog.HEADER.unpack_from(data, position)
+        position += headerSize
+        if kind == RollLog.SNAPSHOT:
+            rolls[gameId] = data[position:position + count]
+        else:
+            rolls[gameId] = rolls.get(gameId, '') + \
+                data[position:position + count]
+        position += count
+
+def loadGames (fileName):
+    """
+        Restores all games of a RollLog file and its archive with a single
+        read of each. Returns a dictionary from game id to 
+        CompactBowlingGame.
+    """
+    rolls = {}
+    _readRollRecords(fileName, rolls)
+    if os.path.exists(fileName + '.archive'):
+        _readRollRecords(fileName + '.archive', rolls)
+    
+    return dict((gameId, CompactBowlingGame.fromRolls(gameRolls))
+                for (gameId, gameRolls) in rolls.items())
+
+# A state of the outcome analysis is a tuple of (frame, rolls made in that 
+# frame, bonuses waiting for one more roll, bonuses waiting for two more 
+# rolls, rolls of frame 9 if it is waiting for the last frame). Frame 11 
+# means the game is over. Every roll adds its share to the final score right 
+# away, so the final score is the sum of all additions.
+_INITIAL_OUTCOME_STATE = (1, (), 0, 0, ())
+_FINAL_OUTCOME_FRAME = 11
+
+def _createFrame (frameNumber, rolls):
+    frame = LastFrame(frameNumber) if frameNumber == 10 else Frame(frameNumber)
+    for pins in rolls:
+        frame.hitPins(pins)
+    return frame
+
+def _possiblePins (state):
+    standing = 10
+    for pins in state[1]:
+        standing -= pins
+        if standing == 0:
+            standing = 10
+    return range(0, standing + 1)
+
+def _nextOutcomeState (state, pins):
+    """
+        Returns the state after rolling pins and the points this roll adds 
+        to the final score. Strikes and spares of frames 1 to 8 add their 
+        bonus to the next rolls. Frame 9 depends on the last frame in more 
+        ways, so a strike or spare there is scored with Frame.calculateScore
+        once the last frame is complete.
+    """
+    (frameNumber, rolls, pendingOne, pendingTwo, ninthRolls) = state
+    added = pins * (pendingOne + pendingTwo)
+    (pendingOne, pendingTwo) = (pendingTwo, 0)
+    rolls += (pins,)
+    
+    frame = _createFrame(frameNumber, rolls)
+    if frame.running:
+        return ((frameNumber, rolls, pendingOne, pendingTwo, ninthRolls), 
+                added)
+    
+    if frameNumber == 10:
+        added += frame.calculateScore()
+        if ninthRolls:
+            added += _createFrame(9, ninthRolls).calculateScore(frame)
+        return ((_FINAL_OUTCOME_FRAME, (), 0, 0, ()), added)
+    
+    if frameNumber == 9 and (frame.strike or frame.spare):
+        return ((10, (), pendingOne, pendingTwo, rolls), added)
+    
+    added += frame.pinsFirstRoll + frame.pinsSecondRoll
+    if frame.strike:
+        pendingTwo += 1
+    elif frame.spare:
+        pendingOne += 1
+    return ((frameNumber + 1, (), pendingOne, pendingTwo, ()), added)
+
+_maximumScores = {}
+_scoreDistributions = {}
+
+def _maximumFutureScore (state):
+    if state[0] == _FINAL_OUTCOME_FRAME:
+        return 0
+    if state not in _maximumScores:
+        _maximumScores[state] = max(
+            added + _maximumFutureScore(nextState) 
+            for (nextState, added) in (_nextOutcomeState(state, pins) 
+                                       for pins in _possiblePins(state)))
+    return _maximumScores[state]
+
+def _futureScoreDistribution (state):
+    if state[0] == _FINAL_OUTCOME_FRAME:
+        return {0: 1}
+    if state not in _scoreDistributions:
+        distribution = {}
+        for pins in _possiblePins(state):
+            (nextState, added) = _nextOutcomeState(state, pins)
+            for (score, count) in \
+                    _futureScoreDistribution(nextState).iteritems():
+                distribution[score + added] = \
+                    distribution.get(score + added, 0) + count
+        _scoreDistributions[state] = distribution
+    return _scoreDistributions[state]
+
+def _gameRolls (game):
+    if isinstance(game, CompactBowlingGame):
+        return bytearray(game.rolls)
+    
+    rolls = []
+    for frame in game._frames:
+        pins = [frame.pinsFirstRoll, frame.pinsSecondRoll, 
+                getattr(frame, 'pinsThirdRoll', -1)]
+        if not isinstance(frame, LastFrame) and frame.pinsFirstRoll == 10:
+            pins = pins[:1]
+        rolls.extend(pin for pin in pins if pin != -1)
+    return rolls
+
+def _replay (game):
+    state = _INITIAL_OUTCOME_STATE
+    score = 0
+    for pins in _gameRolls(game)[:CompactBowlingGame.MAX_ROLLS]:
+        if state[0] == _FINAL_OUTCOME_FRAME:
+            break
+        (state, added) = _nextOutcomeState(state, pins)
+        score += added
+    return (state, score)
+
+def maximumScore (game):
+    """
+        Returns the highest final score the (partially played) game can
+        still reach.
+    """
+    (state, score) = _replay(game)
+    return score + _maximumFutureScore(state)
+
+def scoreDistribution (game):
+    """
+        Returns a dictionary from every final score the game can still
+        reach to the number of roll sequences leading to it.
+    """
+    (state, score) = _replay(game)
+    return dict((futureScore + score, count) for (futureScore, count) 
+                in _futureScoreDistribution(state).iteritems())
+
+def countRollSequences (game):
+    (state, score) = _replay(game)
+    return sum(_futureScoreDistribution(state).itervalues())
+
+def scoreFrames (rolls, count=None):
+    """
+        Returns the scores of all ten frames after making the first count
+        rolls (all by default). Follows the rules of Frame and LastFrame
+        exactly, including frames that are not settled yet scoring zero.
+    """
+    if count is None:
+        count = len(rolls)
+    roll = lambda i: rolls[i] if i < count else NO_ROLL
+    
+    frames = []
+    position = 0
+    for frameNumber in range(1, 10):
+        first = roll(position)
+        second = 0 if first == 10 else roll(position + 1)
+        new = first == NO_ROLL
+        running = not new and second == NO_ROLL
+        complete = not new and not running
+        frames.append((first, second, new, running, 
+                       complete and first == 10,
+                       complete and first < 10 and first + second == 10))
+        position += 1 if first == 10 else 2
+    
+    first = roll(position)
+    second = roll(position + 1)
+    third = roll(position + 2)
+    new = first == NO_ROLL
+    hasThirdRoll = first == 10 or first + second == 10
+    if new:
+        running = True
+    elif hasThirdRoll:
+        running = third == NO_ROLL
+    else:
+        running = second == NO_ROLL
+    frames.append((first, second, new, running, 
+                   not running and first == 10, False))
+    frames.append((NO_ROLL, NO_ROLL, True, False, False, False))
+    
+    if running:
+        lastScore = 0
+    elif not hasThirdRoll:
+        lastScore = first + second
+    else:
+        lastScore = scoreLastFrameWithThirdRoll(first, second, third)
+    
+    scores = []
+    for i in range(9):
+        (first, second, new, running, strike, spare) = frames[i]
+        plusOne = frames[i + 1]
+        plusTwo = frames[i + 2]
+        if new or running:
+            scores.append(0)
+        elif strike:
+            if plusOne[2] or plusOne[3]:
+                scores.append(0)
+            elif plusOne[4]:
+                scores.append(0 if plusTwo[2] else 20 + plusTwo[0])
+            else:
+                scores.append(10 + plusOne[0] + plusOne[1])
+        elif spare:
+            scores.append(0 if plusOne[2] else 10 + plusOne[0])
+        else:
+            scores.append(first + second)
+    scores.append(lastScore)
+    return scores
+
+# Marks rolls that have not been made (yet), like the -1 used by Frame.
+NO_ROLL = -1
+
+def scoreGames (rolls):
+    """
+        Scores many games at once using numpy. rolls is a 2-D array with one
+        row of up to 21 rolls per game, padded with NO_ROLL. Returns a tuple
+        of the games' scores and their cumulative score after every frame
+        (games x 10), both agreeing with BowlingGame.score after making the
+        same rolls.
+    """
+    if numpy is None:
+        raise ImportError('scoreGames requires numpy')
+    
+    rolls = numpy.asarray(rolls, dtype=numpy.int16)
+    games = len(rolls)
+    padded = numpy.empty((games, 24), dtype=numpy.int16)
+    padded.fill(NO_ROLL)
+    padded[:, :rolls.shape[1]] = rolls
+    
+    rows = numpy.arange(games)
+    position = numpy.zeros(games, dtype=numpy.intp)
+    frames = []
+    for frameNumber in range(1, 10):
+        first = padded[rows, position]
+        second = numpy.where(first == 10, 0, padded[rows, position + 1])
+        new = first == NO_ROLL
+        running = ~new & (second == NO_ROLL)
+        complete = ~new & ~running
+        frames.append(dict(first=first, second=second, new=new, 
+                           running=running, 
+                           strike=complete & (first == 10),
+                           spare=complete & (first < 10) & 
+                                 (first + second == 10)))
+        position += numpy.where(first == 10, 1, 2)
+    
+    first = padded[rows, position]
+    second = padded[rows, position + 1]
+    third = padded[rows, position + 2]
+    new = first == NO_ROLL
+    hasThirdRoll = (first == 10) | (first + second == 10)
+    running = new | numpy.where(hasThirdRoll, third == NO_ROLL, 
+                                second == NO_ROLL)
+    frames.append(dict(first=first, second=second, new=new, running=running,
+                       strike=~running & (first == 10)))
+    missing = dict(new=numpy.ones(games, dtype=bool))
+    
+    scores = numpy.zeros((games, 10), dtype=numpy.int16)
+    for i in range(9):
+        frame = frames[i]
+        plusOne = frames[i + 1]
+        plusTwo = frames[i + 2] if i < 8 else missing
+        
+        strikeScore = numpy.where(
+            plusOne['new'] | plusOne['running'], 0,
+            numpy.where(plusOne['strike'],
+                        numpy.where(plusTwo['new'], 0, 
+                                    20 + plusTwo.get('first', 0)),
+                        10 + plusOne['first'] + plusOne['second']))
+        spareScore = numpy.where(plusOne['new'], 0, 10 + plusOne['first'])
+        scores[:, i] = numpy.where(
+            frame['new'] | frame['running'], 0,
+            numpy.where(frame['strike'], strikeScore,
+                        numpy.where(frame['spare'], spareScore, 
+                                    frame['first'] + frame['second'])))
+    
+    lastScore = scoreLastFrameWithThirdRoll(first, second, third)
+    scores[:, 9] = numpy.where(running, 0, 
+                               numpy.where(hasThirdRoll, lastScore, 
+                                           first + second))
+    
+    cumulativeScores = numpy.cumsum(scores, axis=1)
+    return (cumulativeScores[:, 9], cumulativeScores)
+
 class BowlingGameTest (unittest.TestCase):
     def setUp (self):
         self.game = BowlingGame()
@@ -314,4 +850,281 @@ class BowlingGameTest (unittest.TestCase):
         self.game.hitPins(10)
         self.game.hitPins(10)
 
-        self.assertEquals(300, self.game.score)
\ No newline at end of file
+        self.assertEquals(300, self.game.score)
+
+    def testShouldKeepRunningScoreEqualToScoreOfAllFrames (self):
+        generator = random.Random(0)
+        for i in range(200):
+            game = BowlingGame()
+            for pins in generateRolls(generator):
+                game.hitPins(pins)
+                self.assertEquals(game._calculateScore(), game.score)
+
+def generateRolls (generator):
+    """
+        Returns the rolls of a random but valid complete game.
+    """
+    rolls = []
+    for frame in range(9):
+        rolls.append(generator.randint(0, 10))
+        if rolls[-1] < 10:
+            rolls.append(generator.randint(0, 10 - rolls[-1]))
+    
+    first = generator.randint(0, 10)
+    second = generator.randint(0, 10 if first == 10 else 10 - first)
+    rolls.extend([first, second])
+    if first == 10:
+        rolls.append(generator.randint(0, 10 if second == 10 else 10 - second))
+    elif first + second == 10:
+        rolls.append(generator.randint(0, 10))
+    return rolls
+
+@unittest.skipIf(numpy is None, 'numpy is not available')
+class ScoreGamesTest (unittest.TestCase):
+    def testShouldScorePerfectGame (self):
+        (scores, frameScores) = scoreGames([[10] * 12])
+        
+        self.assertEquals([300], scores.tolist())
+        self.assertEquals([[30, 60, 90, 120, 150, 180, 210, 240, 240, 300]], 
+                          frameScores.tolist())
+
+    def testShouldScoreGamesOfDifferentLength (self):
+        (scores, frameScores) = scoreGames([[5, 3, NO_ROLL], [10, 5, 3]])
+        
+        self.assertEquals([8, 26], scores.tolist())
+
+    def testShouldAgreeWithBowlingGameOnCompleteAndPartialGames (self):
+        generator = random.Random(0)
+        games = []
+        for i in range(500):
+            rolls = generateRolls(generator)
+            games.append(rolls[:generator.randint(0, len(rolls))])
+        
+        rolls = [game + [NO_ROLL] * (21 - len(game)) for game in games]
+        (scores, frameScores) = scoreGames(rolls)
+        for (i, rolls) in enumerate(games):
+            game = BowlingGame()
+            for pins in rolls:
+                game.hitPins(pins)
+            
+            self.assertEquals(game.score, scores[i])
+            
+            cumulativeScore = 0
+            for frame in range(10):
+                if frame < len(game._frames):
+                    cumulativeScore += game._calculateFrameScore(frame)
+                self.assertEquals(cumulativeScore, frameScores[i][frame])
+
+class CompactBowlingGameTest (BowlingGameTest):
+    def setUp (self):
+        self.game = CompactBowlingGame()
+
+    def testShouldAgreeWithBowlingGameAfterEveryRoll (self):
+        generator = random.Random(0)
+        for i in range(200):
+            game = BowlingGame()
+            compactGame = CompactBowlingGame()
+            for pins in generateRolls(generator):
+                game.hitPins(pins)
+                compactGame.hitPins(pins)
+                self.assertEquals((game.frame, game.roll, game.score), 
+                                  (compactGame.frame, compactGame.roll, 
+                                   compactGame.score))
+
+    def testShouldRejectRollsAfterGameIsOver (self):
+        for i in range(CompactBowlingGame.MAX_ROLLS):
+            self.game.hitPins(5)
+        
+        self.assertRaises(ValueError, self.game.hitPins, 5)
+        self.assertRaises(ValueError, CompactBowlingGame.fromRolls, 
+                          '\x05' * 22)
+        self.assertRaises(ValueError, CompactBowlingGame.fromRolls, 
+                          '\x00' * 21)
+
+    def testShouldRestoreEveryPartialGameFromRolls (self):
+        generator = random.Random(1)
+        for i in range(100):
+            game = CompactBowlingGame()
+            for pins in generateRolls(generator):
+                game.hitPins(pins)
+                restored = CompactBowlingGame.fromRolls(game.rolls)
+                self.assertEquals((game.frame, game.roll, game.score, 
+                                   game.over), 
+                                  (restored.frame, restored.roll, 
+                                   restored.score, restored.over))
+            self.assertTrue(game.over)
+
+    def testShouldNotHaveInstanceDictionary (self):
+        self.assertFalse(hasattr(self.game, '__dict__'))
+
+class RollLogTest (unittest.TestCase):
+    def setUp (self):
+        (handle, self.fileName) = tempfile.mkstemp()
+        os.close(handle)
+        os.remove(self.fileName)
+
+    def tearDown (self):
+        for fileName in (self.fileName, self.fileName + '.archive'):
+            if os.path.exists(fileName):
+                os.remove(fileName)
+
+    def testShouldWriteOneHeaderAndOneBytePerRoll (self):
+        log = RollLog(self.fileName, flushSeconds=3600)
+        for pins in [5, 3, 10, 4]:
+            log.hitPins(7, pins)
+        log.close()
+        
+        self.assertEquals(RollLog.HEADER.size + 4, 
+                          os.path.getsize(self.fileName))
+
+    def testShouldRestoreFlushedRollsWithoutClosingLog (self):
+        generator = random.Random(2)
+        games = dict((gameId, generateRolls(generator)[:3]) 
+                     for gameId in range(100))
+        
+        log = RollLog(self.fileName, flushInterval=10, flushSeconds=3600)
+        for roll in range(3):
+            for (gameId, rolls) in games.items():
+                log.hitPins(gameId, rolls[roll])
+        restored = loadGames(self.fileName)
+        log.close()
+        
+        self.assertEquals(dict((gameId, str(bytearray(rolls))) 
+                               for (gameId, rolls) in games.items()), 
+                          dict((gameId, game.rolls) 
+                               for (gameId, game) in restored.items()))
+
+    def testShouldFlushRollsAfterFlushSeconds (self):
+        log = RollLog(self.fileName, flushSeconds=0)
+        log.hitPins(1, 4)
+        
+        self.assertEquals('\x04', loadGames(self.fileName)[1].rolls)
+        log.close()
+
+    def testShouldRejectRollsForGamesThatAreOver (self):
+        log = RollLog(self.fileName)
+        for pins in [10] * 12:
+            log.hitPins(7, pins)
+        
+        self.assertRaises(ValueError, log.hitPins, 7, 3)
+        log.close()
+        
+        log = RollLog(self.fileName)
+        self.assertRaises(ValueError, log.hitPins, 7, 3)
+        log.close()
+
+    def testShouldArchiveGamesThatAreOver (self):
+        log = RollLog(self.fileName)
+        for pins in [10] * 12:
+            log.hitPins(7, pins)
+        log.hitPins(8, 4)
+        log.snapshot()
+        log.close()
+        
+        self.assertEquals(RollLog.HEADER.size + 12, 
+                          os.path.getsize(self.fileName + '.archive'))
+        self.assertEquals(RollLog.HEADER.size + 1, 
+                          os.path.getsize(self.fileName))
+        self.assertEquals(300, loadGames(self.fileName)[7].score)
+
+    def testShouldRestoreGamesFromLogAndSnapshots (self):
+        generator = random.Random(0)
+        games = dict((gameId, generateRolls(generator)) 
+                     for gameId in range(50))
+        
+        log = RollLog(self.fileName, snapshotInterval=97)
+        for roll in range(21):
+            for (gameId, rolls) in games.items():
+                if roll < len(rolls):
+                    log.hitPins(gameId, rolls[roll])
+        log.snapshot()
+        self.assertEquals(0, os.path.getsize(self.fileName))
+        log.close()
+        restored = loadGames(self.fileName)
+        
+        self.assertEquals(sorted(games), sorted(restored))
+        for (gameId, rolls) in games.items():
+            game = BowlingGame()
+            for pins in rolls:
+                game.hitPins(pins)
+            self.assertEquals((game.frame, game.roll, game.score),
+                              (restored[gameId].frame, restored[gameId].roll,
+                               restored[gameId].score))
+
+    def testShouldContinueExistingLog (self):
+        log = RollLog(self.fileName)
+        log.hitPins(1, 10)
+        log.close()
+        
+        log = RollLog(self.fileName, snapshotInterval=1)
+        log.hitPins(1, 5)
+        log.hitPins(2, 3)
+        log.close()
+        restored = loadGames(self.fileName)
+        
+        self.assertEquals('\x0a\x05', restored[1].rolls)
+        self.assertEquals('\x03', restored[2].rolls)
+
+class OutcomeAnalysisTest (unittest.TestCase):
+    def playGame (self, rolls):
+        game = BowlingGame()
+        for pins in rolls:
+            game.hitPins(pins)
+        return game
+
+    def testShouldReachThreeHundredAndNineFromNewGame (self):
+        # A strike in frame 9 followed by a spare in the last frame scores
+        # more than a perfect game.
+        self.assertEquals(309, maximumScore(BowlingGame()))
+        self.assertEquals(309, self.playGame([10] * 8 + [9, 1] + 
+                                             [10] * 3).score)
+        self.assertEquals(1, scoreDistribution(BowlingGame())[309])
+        self.assertEquals(1, scoreDistribution(BowlingGame())[0])
+
+    def testShouldReturnScoreOfCompleteGame (self):
+        generator = random.Random(0)
+        for i in range(200):
+            game = self.playGame(generateRolls(generator))
+            
+            self.assertEquals(game.score, maximumScore(game))
+            self.assertEquals({game.score: 1}, scoreDistribution(game))
+
+    def testShouldAgreeWithPlayingAllRemainingRolls (self):
+        generator = random.Random(1)
+        for i in range(10):
+            rolls = generateRolls(generator)
+            rolls = rolls[:generator.randint(len(rolls) - 3, len(rolls))]
+            
+            expected = {}
+            for remainingRolls in self.completions(rolls):
+                score = self.playGame(rolls + remainingRolls).score
+                expected[score] = expected.get(score, 0) + 1
+            
+            game = self.playGame(rolls)
+            self.assertEquals(expected, scoreDistribution(game))
+            self.assertEquals(max(expected), maximumScore(game))
+            self.assertEquals(sum(expected.values()), 
+                              countRollSequences(game))
+            self.assertEquals(expected, 
+                              scoreDistribution(CompactBowlingGame
+                                                .fromRolls(rolls)))
+
+    def completions (self, rolls):
+        state = _INITIAL_OUTCOME_STATE
+        for pins in rolls:
+            (state, added) = _nextOutcomeState(state, pins)
+        
+        def complete (state):
+            if state[0] == _FINAL_OUTCOME_FRAME:
+                yield []
+                return
+            for pins in _possiblePins(state):
+                for rest in complete(_nextOutcomeState(state, pins)[0]):
+                    yield [pins] + rest
+        return list(complete(state))
+
+    def testShouldCountAllRollSequencesOfLastFrame (self):
+        game = self.playGame([0] * 18)
+        
+        # open frames, spares, two strikes and a strike followed by 0-9 
+        self.assertEquals(55 + 10 * 11 + 11 + 65, countRollSequences(game))
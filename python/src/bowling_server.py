@@ -0,0 +1,429 @@
+"""
+    A small event loop server keeping the BowlingGames of many lanes.
+
+    Clients talk a line based protocol:
+        ROLL <lane> <pins> [<lane> <pins> ...]  records rolls on lanes
+        RESET <lane> [<lane> ...]               starts new games on lanes
+        SUBSCRIBE [<lane> ...]                  receives score updates of
+                                                the given or all lanes
+
+    Score updates are not pushed once per roll. All lanes changed while
+    handling one tick of the event loop are sent to the subscribers as a
+    single line:
+        SCORES <lane> <rolls> <score> [<lane> <rolls> <score> ...]
+"""
+import asynchat
+import asyncore
+import random
+import socket
+import sys
+import time
+import unittest
+
+from bowling import BowlingGame, generateRolls
+
+class LaneStore (object):
+    def __init__ (self):
+        self._games = {}
+        self._rolls = {}
+        self._changed = {}
+
+    def hitPins (self, lane, pins):
+        self.hitPinsOnLanes([(lane, pins)])
+
+    def hitPinsOnLanes (self, rolls):
+        """
+            Records (lane, pins) rolls. Nothing is recorded if any of them
+            is invalid.
+        """
+        for (lane, pins) in rolls:
+            if not 0 <= pins <= 10:
+                raise ValueError('Invalid number of pins: %d' % pins)
+        for (lane, pins) in rolls:
+            self._addRoll(lane, pins)
+
+    def _addRoll (self, lane, pins):
+        if lane not in self._games:
+            self._games[lane] = BowlingGame()
+            self._rolls[lane] = 0
+        self._games[lane].hitPins(pins)
+        self._rolls[lane] += 1
+        self._changed[lane] = True
+
+    def reset (self, lane):
+        self._games.pop(lane, None)
+        self._rolls.pop(lane, None)
+        self._changed[lane] = True
+
+    def score (self, lane):
+        return self._games[lane].score if lane in self._games else 0
+
+    def rolls (self, lane):
+        return self._rolls.get(lane, 0)
+
+    def popUpdates (self):
+        """
+            Returns (lane, rolls, score) for every lane changed since the
+            last call. A lane rolled several times shows up only once.
+        """
+        updates = [(lane, self.rolls(lane), self.score(lane))
+                   for lane in sorted(self._changed)]
+        self._changed = {}
+        return updates
+
+class BowlingConnection (asynchat.async_chat):
+    def __init__ (self, server, sock, map=None):
+        asynchat.async_chat.__init__(self, sock, map)
+        self._server = server
+        self._buffer = []
+        self.set_terminator('\n')
+
+    def collect_incoming_data (self, data):
+        self._buffer.append(data)
+
+    def found_terminator (self):
+        line = ''.join(self._buffer)
+        self._buffer = []
+        try:
+            self._server.handleCommand(self, line.split())
+        except ValueError as error:
+            self.push('ERROR %s\n' % error)
+
+    def handle_close (self):
+        self._server.unsubscribe(self)
+        self.close()
+
+class BowlingServer (asyncore.dispatcher):
+    def __init__ (self, host='localhost', port=0, store=None, map=None):
+        asyncore.dispatcher.__init__(self, map=map)
+        self.store = store if store is not None else LaneStore()
+        self.subscribers = set()
+        self._laneSubscribers = {}
+        self._subscribedLanes = {}
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(1024)
+
+    @property
+    def address (self):
+        return self.socket.getsockname()
+
+    def handle_accept (self):
+        pair = self.accept()
+        if pair is not None:
+            BowlingConnection(self, pair[0], self._map)
+
+    def handleCommand (self, connection, words):
+        if words[:1] == ['ROLL'] and len(words) >= 3 and len(words) % 2 == 1:
+            self.store.hitPinsOnLanes([(int(words[i]), int(words[i + 1]))
+                                       for i in range(1, len(words), 2)])
+        elif words[:1] == ['RESET'] and len(words) >= 2:
+            for lane in [int(word) for word in words[1:]]:
+                self.store.reset(lane)
+        elif words == ['SUBSCRIBE']:
+            self.subscribers.add(connection)
+        elif words[:1] == ['SUBSCRIBE']:
+            lanes = [int(word) for word in words[1:]]
+            for lane in lanes:
+                self._laneSubscribers.setdefault(lane, set()).add(connection)
+            self._subscribedLanes.setdefault(connection, set()).update(lanes)
+        else:
+            raise ValueError('Invalid command: %s' % ' '.join(words))
+
+    def unsubscribe (self, connection):
+        self.subscribers.discard(connection)
+        for lane in self._subscribedLanes.pop(connection, ()):
+            self._laneSubscribers[lane].discard(connection)
+            if not self._laneSubscribers[lane]:
+                del self._laneSubscribers[lane]
+
+    def flush (self):
+        """
+            Pushes the lanes changed during the last tick to their
+            subscribers, one line per subscriber.
+        """
+        updates = self.store.popUpdates()
+        batches = {}
+        for update in updates:
+            for subscriber in self._laneSubscribers.get(update[0], ()):
+                batches.setdefault(subscriber, []).append(update)
+        if updates:
+            for subscriber in self.subscribers:
+                batches[subscriber] = updates
+        
+        for (subscriber, batch) in batches.iteritems():
+            subscriber.push('SCORES %s\n' % ' '.join('%d %d %d' % update
+                                                     for update in batch))
+        return len(updates)
+
+    def serveForever (self, timeout=0.05):
+        runLoop(self._map, [self], timeout=timeout)
+
+def runLoop (map, servers=(), until=lambda: False, timeout=0.05):
+    """
+        Runs the event loop one tick at a time, flushing the coalesced score
+        updates of the servers after every tick.
+    """
+    if map is None:
+        map = asyncore.socket_map
+    while map and not until():
+        asyncore.loop(timeout, True, map, 1)
+        for server in servers:
+            server.flush()
+
+class LoadTestClient (asynchat.async_chat):
+    """
+        Plays one random game on each of the given lanes. The next roll of a
+        lane is sent as soon as the score of its previous roll arrives, and
+        the time in between is recorded as the roll's latency.
+    """
+    def __init__ (self, address, lanes, seed=0, map=None):
+        asynchat.async_chat.__init__(self, map=map)
+        generator = random.Random(seed)
+        self._games = dict((lane, generateRolls(generator)) for lane in lanes)
+        self._played = dict((lane, 0) for lane in lanes)
+        self._sentAt = {}
+        self._buffer = []
+        self.latencies = []
+        self.scores = {}
+        self.failure = None
+        self.set_terminator('\n')
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(address)
+
+    @property
+    def finished (self):
+        return not self._games
+
+    def handle_error (self):
+        self.failure = str(sys.exc_info()[1])
+        self.close()
+
+    def handle_close (self):
+        if not self.finished and self.failure is None:
+            self.failure = 'Connection closed by server'
+        self.close()
+
+    def handle_connect (self):
+        lanes = sorted(self._games)
+        words = ' '.join(str(lane) for lane in lanes)
+        self.push('SUBSCRIBE %s\nRESET %s\n' % (words, words))
+        self._roll(lanes)
+
+    def _roll (self, lanes):
+        if not lanes:
+            return
+        words = ['ROLL']
+        now = time.time()
+        for lane in lanes:
+            words.append(str(lane))
+            words.append(str(self._games[lane][self._played[lane]]))
+            self._played[lane] += 1
+            self._sentAt[lane] = now
+        self.push(' '.join(words) + '\n')
+
+    def collect_incoming_data (self, data):
+        self._buffer.append(data)
+
+    def found_terminator (self):
+        words = ''.join(self._buffer).split()
+        self._buffer = []
+        if words[:1] != ['SCORES']:
+            raise ValueError('Unexpected response: %s' % ' '.join(words))
+
+        now = time.time()
+        lanes = []
+        for i in range(1, len(words), 3):
+            (lane, rolls, score) = (int(words[i]), int(words[i + 1]),
+                                    int(words[i + 2]))
+            if lane not in self._games or rolls != self._played[lane]:
+                continue
+            self.latencies.append(now - self._sentAt[lane])
+            if rolls < len(self._games[lane]):
+                lanes.append(lane)
+            else:
+                self.scores[lane] = score
+                del self._games[lane]
+        self._roll(lanes)
+        if self.finished:
+            self.close()
+
+def percentile (values, percent):
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+def loadTest (address, lanes=10000, connections=10, map=None, servers=()):
+    """
+        Drives lanes simulated lanes over connections client connections
+        and returns the number of rolls, the seconds taken and the p50 and
+        p99 roll-to-score latencies in seconds. Pass the servers of an in
+        process BowlingServer sharing map to run both in one event loop.
+        Raises an IOError if any connection fails.
+    """
+    if map is None:
+        map = {}
+    clients = [LoadTestClient(address, range(i, lanes, connections), i, map)
+               for i in range(connections)]
+    started = time.time()
+    runLoop(map, servers,
+            until=lambda: all(client.finished or client.failure 
+                              for client in clients))
+    failures = [client.failure for client in clients if client.failure]
+    if failures:
+        raise IOError('%d of %d load test connections failed: %s' % 
+                      (len(failures), connections, failures[0]))
+    latencies = sum((client.latencies for client in clients), [])
+    return {
+        'rolls': len(latencies),
+        'seconds': time.time() - started,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+class LaneStoreTest (unittest.TestCase):
+    def setUp (self):
+        self.store = LaneStore()
+
+    def testShouldCoalesceRollsOfOneLaneIntoOneUpdate (self):
+        self.store.hitPins(1, 10)
+        self.store.hitPins(2, 3)
+        self.store.hitPins(1, 4)
+
+        self.assertEquals([(1, 2, 0), (2, 1, 0)], self.store.popUpdates())
+        self.assertEquals([], self.store.popUpdates())
+
+    def testShouldStartNewGameOnReset (self):
+        self.store.hitPins(1, 4)
+        self.store.reset(1)
+
+        self.assertEquals([(1, 0, 0)], self.store.popUpdates())
+
+    def testShouldRejectInvalidNumberOfPins (self):
+        self.assertRaises(ValueError, self.store.hitPins, 1, 11)
+
+class BowlingServerTest (unittest.TestCase):
+    def setUp (self):
+        self.map = {}
+        self.server = BowlingServer(map=self.map)
+
+    def tearDown (self):
+        asyncore.close_all(self.map)
+
+    def testShouldScoreGamesOfAllLanes (self):
+        result = loadTest(self.server.address, lanes=50, connections=3,
+                          map=self.map, servers=[self.server])
+
+        rolls = 0
+        for connection in range(3):
+            generator = random.Random(connection)
+            for lane in range(connection, 50, 3):
+                game = BowlingGame()
+                for pins in generateRolls(generator):
+                    game.hitPins(pins)
+                    rolls += 1
+                self.assertEquals(game.score, self.server.store.score(lane))
+        self.assertEquals(rolls, result['rolls'])
+        self.assertTrue(result['p50'] <= result['p99'])
+
+    def testShouldPushOneBatchPerSubscriberAndTick (self):
+        lines = {}
+        class Subscriber (object):
+            def __init__ (self, name):
+                self.name = name
+            def push (self, line):
+                lines.setdefault(self.name, []).append(line)
+        
+        self.server.handleCommand(Subscriber('all'), ['SUBSCRIBE'])
+        self.server.handleCommand(Subscriber('two'), ['SUBSCRIBE', '2'])
+        self.server.handleCommand(None, ['ROLL', '1', '3', '2', '4', '2', '6'])
+        self.server.handleCommand(None, ['ROLL', '1', '5'])
+        self.server.flush()
+        
+        self.assertEquals({'all': ['SCORES 1 2 8 2 2 0\n'], 
+                           'two': ['SCORES 2 2 0\n']}, lines)
+
+    def testShouldNotRecordAnyRollOfCommandWithInvalidRoll (self):
+        self.assertRaises(ValueError, self.server.handleCommand, None,
+                          ['ROLL', '1', '5', '2', '11'])
+        
+        self.assertEquals(0, self.server.store.rolls(1))
+        self.assertEquals([], self.server.store.popUpdates())
+
+    def testShouldSubscribeConnectionOnlyOnce (self):
+        lines = []
+        class Subscriber (object):
+            def push (self, line):
+                lines.append(line)
+        subscriber = Subscriber()
+        
+        for i in range(2):
+            self.server.handleCommand(subscriber, ['SUBSCRIBE'])
+            self.server.handleCommand(subscriber, ['SUBSCRIBE', '1', '1'])
+        self.server.handleCommand(None, ['ROLL', '1', '3'])
+        self.server.flush()
+        self.assertEquals(['SCORES 1 1 0\n'], lines)
+        
+        self.server.unsubscribe(subscriber)
+        self.server.handleCommand(None, ['ROLL', '1', '3'])
+        self.server.flush()
+        self.assertEquals(['SCORES 1 1 0\n'], lines)
+
+    def testShouldNotResetAnyLaneOfCommandWithInvalidLane (self):
+        self.server.handleCommand(None, ['ROLL', '1', '5'])
+        self.server.store.popUpdates()
+        
+        self.assertRaises(ValueError, self.server.handleCommand, None,
+                          ['RESET', '1', 'x'])
+        self.assertEquals(1, self.server.store.rolls(1))
+        self.assertEquals([], self.server.store.popUpdates())
+
+    def testShouldReportConnectionErrorWhenServerIsNotReachable (self):
+        address = self.server.address
+        self.server.close()
+        
+        self.assertRaises(IOError, loadTest, address, lanes=5, 
+                          connections=2, map=self.map)
+
+    def testShouldAnswerInvalidCommandsWithError (self):
+        client = asynchat.async_chat(map=self.map)
+        client.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(self.server.address)
+        responses = []
+        client.set_terminator('\n')
+        client.collect_incoming_data = responses.append
+        client.found_terminator = lambda: None
+        client.push('ROLL 1\n')
+
+        runLoop(self.map, [self.server], until=lambda: responses)
+
+        self.assertEquals(['ERROR Invalid command: ROLL 1'], responses)
+
+if __name__ == '__main__':
+    import argparse
+    
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--port', type=int, default=7733)
+    argument_parser.add_argument('--load-test', action='store_true')
+    argument_parser.add_argument('--local', action='store_true',
+                                 help='run the server in the load test\'s '
+                                      'event loop')
+    argument_parser.add_argument('--lanes', type=int, default=10000)
+    argument_parser.add_argument('--connections', type=int, default=10)
+    arguments = argument_parser.parse_args()
+    
+    if not arguments.load_test:
+        BowlingServer(port=arguments.port).serveForever()
+    else:
+        map = {}
+        servers = [BowlingServer(port=arguments.port, map=map)] \
+            if arguments.local else []
+        address = servers[0].address if servers else \
+            ('localhost', arguments.port)
+        try:
+            result = loadTest(address, arguments.lanes, arguments.connections, 
+                              map, servers)
+        except IOError as error:
+            argument_parser.exit(1, 'Load test failed: %s\n' % error)
+        print "%(rolls)d rolls in %(seconds).2fs, p50 %(p50).4fs, " \
+              "p99 %(p99).4fs" % result
@@ -8,6 +8,13 @@
     the needle.
 """
 
+import array
+import mmap
+import multiprocessing
+import os
+import random
+import tempfile
+import time
 import unittest
 
 def grep (needle, *haystack):
@@ -16,6 +23,340 @@ def grep (needle, *haystack):
     
     return [line for line in haystack if needle in line.split()]
 
+class GrepStats (object):
+    """
+        Counters and timings collected by grepWithStats. Times are given in
+        seconds and accumulate over all calls until reset is called.
+    """
+    def __init__ (self):
+        self.reset()
+
+    def reset (self):
+        self.linesScanned = 0
+        self.bytesScanned = 0
+        self.matches = 0
+        self.tokenizeSeconds = 0.0
+        self.matchSeconds = 0.0
+
+    def __repr__ (self):
+        return ('GrepStats(linesScanned=%d, bytesScanned=%d, matches=%d, '
+                'tokenizeSeconds=%.6f, matchSeconds=%.6f)') % \
+            (self.linesScanned, self.bytesScanned, self.matches, 
+             self.tokenizeSeconds, self.matchSeconds)
+
+def grepWithStats (stats, needle, *haystack):
+    """
+        Works like grep but records lines and bytes scanned, matches and the
+        time spent splitting lines and matching the needle in stats.
+    """
+    if not needle:
+        raise ValueError("No needle given")
+    
+    start = time.time()
+    words = [line.split() for line in haystack]
+    tokenized = time.time()
+    result = [line for (line, lineWords) in zip(haystack, words) 
+              if needle in lineWords]
+    matched = time.time()
+    
+    stats.linesScanned += len(haystack)
+    stats.bytesScanned += sum(len(line) for line in haystack)
+    stats.matches += len(result)
+    stats.tokenizeSeconds += tokenized - start
+    stats.matchSeconds += matched - tokenized
+    return result
+
+def generateCorpus (lines=10000, lineLength=10, vocabularySize=1000, 
+                    hitRate=0.1, seed=0):
+    """
+        Generates a reproducible haystack of lines with lineLength words
+        drawn from vocabularySize distinct words. About hitRate of the
+        lines contain the returned needle, which is not part of the
+        vocabulary. Returns (needle, haystack).
+    """
+    generator = random.Random(seed)
+    needle = 'needle'
+    vocabulary = ['w%d' % i for i in range(vocabularySize)]
+    
+    haystack = []
+    for line in range(lines):
+        words = [generator.choice(vocabulary) for word in range(lineLength)]
+        if generator.random() < hitRate:
+            words[generator.randrange(lineLength)] = needle
+        haystack.append(' '.join(words))
+    return (needle, haystack)
+
+def _grepIndexed (needle, *haystack):
+    return GrepIndex(*haystack).grep(needle)
+
+def _grepStreamed (needle, *haystack):
+    return list(grepStream(needle, haystack))
+
+def _grepManyNeedles (needle, *haystack):
+    return [line for (line, matched) in grepMany([needle], *haystack)]
+
+BENCHMARK_ENGINES = {
+    'grep': grep,
+    'grepIndex': _grepIndexed,
+    'grepStream': _grepStreamed,
+    'grepMany': _grepManyNeedles,
+}
+
+BENCHMARK_CORPORA = [
+    dict(lineLength=10, vocabularySize=1000, hitRate=0.1),
+    dict(lineLength=100, vocabularySize=1000, hitRate=0.1),
+    dict(lineLength=10, vocabularySize=100000, hitRate=0.1),
+    dict(lineLength=10, vocabularySize=1000, hitRate=0.9),
+    dict(lineLength=10, vocabularySize=1000, hitRate=0.001),
+]
+
+def benchmark (corpora=BENCHMARK_CORPORA, engines=BENCHMARK_ENGINES, 
+               lines=10000, repeat=3, seed=0):
+    """
+        Runs every engine against a generated corpus for each entry of
+        corpora (keyword arguments for generateCorpus). Returns
+        (corpus, engine, seconds) tuples with the best of repeat runs, as
+        well as the file based grepStream on the same corpus. Raises an
+        AssertionError when an engine disagrees with grep.
+    """
+    results = []
+    for corpus in corpora:
+        (needle, haystack) = generateCorpus(lines=lines, seed=seed, **corpus)
+        expected = grep(needle, *haystack)
+        
+        (handle, fileName) = tempfile.mkstemp()
+        try:
+            os.write(handle, '\n'.join(haystack))
+            os.close(handle)
+            
+            timed = dict((name, lambda engine=engine: engine(needle, 
+                                                             *haystack))
+                         for (name, engine) in engines.items())
+            timed['grepStreamFile'] = lambda: list(grepStream(needle, 
+                                                              fileName))
+            for name in sorted(timed):
+                best = None
+                for i in range(repeat):
+                    start = time.time()
+                    found = timed[name]()
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                if found != expected:
+                    raise AssertionError('Engine %s disagrees' % name)
+                results.append((corpus, name, best))
+        finally:
+            os.remove(fileName)
+    return results
+
+def grepMany (needles, *haystack):
+    """
+        Searches for all needles in a single pass over the haystack. Returns
+        a list of (line, matchedNeedles) pairs for the lines containing at
+        least one needle; matchedNeedles keeps the order of needles.
+    """
+    if not needles or not all(needles):
+        raise ValueError("No needle given")
+    
+    order = {}
+    for needle in needles:
+        order.setdefault(needle, len(order))
+    
+    result = []
+    for line in haystack:
+        words = set(line.split())
+        if len(words) < len(order):
+            matched = [word for word in words if word in order]
+        else:
+            matched = [needle for needle in order if needle in words]
+        if matched:
+            matched.sort(key=order.__getitem__)
+            result.append((line, tuple(matched)))
+    return result
+
+def benchmarkGrepMany (needleCounts=(10, 100, 10000), lines=200, seed=0):
+    """
+        Compares calling grep once per needle with grepMany on a random
+        corpus. Returns (needleCount, loopSeconds, grepManySeconds) tuples.
+    """
+    generator = random.Random(seed)
+    vocabulary = ['w%d' % i for i in range(max(needleCounts) * 2)]
+    haystack = [' '.join(generator.choice(vocabulary) for word in range(10))
+                for line in range(lines)]
+    
+    results = []
+    for needleCount in needleCounts:
+        needles = generator.sample(vocabulary, needleCount)
+        
+        start = time.time()
+        for needle in needles:
+            grep(needle, *haystack)
+        loopSeconds = time.time() - start
+        
+        start = time.time()
+        grepMany(needles, *haystack)
+        results.append((needleCount, loopSeconds, time.time() - start))
+    return results
+
+# The bytes str.split() splits on when called without arguments.
+WHITESPACE = frozenset(' \t\n\r\x0b\x0c')
+
+def grepStream (needle, source):
+    """
+        Lazily yields the lines of source containing the needle as a word.
+        Source is either any iterable of lines or the path of a file. Files
+        are memory mapped and searched for the needle at the byte level;
+        only matching lines are turned into strings (without their line
+        terminator).
+    """
+    if not needle:
+        raise ValueError("No needle given")
+    
+    if isinstance(source, basestring):
+        return _grepFile(needle, source)
+    return (line for line in source if needle in line.split())
+
+def _grepFile (needle, fileName):
+    with open(fileName, 'rb') as stream:
+        if not os.fstat(stream.fileno()).st_size:
+            return
+        buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for (lineStart, lineEnd) in _scanLines(buffer, needle):
+                yield buffer[lineStart:lineEnd]
+        finally:
+            buffer.close()
+
+def _scanLines (buffer, needle, start=0, end=None):
+    """
+        Yields (start, end) offsets of the lines within buffer[start:end]
+        that contain the needle delimited by whitespace. start must be the
+        start of a line.
+    """
+    if any(character in WHITESPACE for character in needle):
+        return
+    if end is None:
+        end = len(buffer)
+    
+    position = buffer.find(needle, start, end)
+    while position != -1:
+        after = position + len(needle)
+        if (position == 0 or buffer[position - 1] in WHITESPACE) and \
+                (after == len(buffer) or buffer[after] in WHITESPACE):
+            lineStart = max(buffer.rfind('\n', start, position) + 1, start)
+            lineEnd = buffer.find('\n', after)
+            if lineEnd == -1:
+                lineEnd = len(buffer)
+            yield (lineStart, lineEnd)
+            position = buffer.find(needle, lineEnd + 1, end)
+        else:
+            position = buffer.find(needle, position + 1, end)
+
+def grepParallel (needle, fileName, workers=None, shards=None):
+    """
+        Returns the lines of a file containing the needle as a word, like
+        grepStream does, but scans line aligned byte ranges of the file in a
+        process pool. Workers only send back line offsets; the matching
+        lines are read from the file by the calling process.
+    """
+    if not needle:
+        raise ValueError("No needle given")
+    workers = workers or multiprocessing.cpu_count()
+    
+    with open(fileName, 'rb') as stream:
+        size = os.fstat(stream.fileno()).st_size
+        if not size:
+            return []
+        buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            ranges = _splitLines(buffer, shards or workers * 4)
+            pool = multiprocessing.Pool(workers)
+            try:
+                offsets = pool.map(_grepRange, [(needle, fileName, start, end)
+                                                for (start, end) in ranges])
+            finally:
+                pool.terminate()
+                pool.join()
+
+            lines = []
+            for rangeOffsets in offsets:
+                for i in range(0, len(rangeOffsets), 2):
+                    lines.append(buffer[rangeOffsets[i]:rangeOffsets[i + 1]])
+            return lines
+        finally:
+            buffer.close()
+
+def _splitLines (buffer, shards):
+    """
+        Splits buffer into at most shards (start, end) ranges of roughly 
+        equal size that each start at the beginning of a line.
+    """
+    size = len(buffer)
+    boundaries = [0]
+    for shard in range(1, shards):
+        lineEnd = buffer.find('\n', max(size * shard // shards, boundaries[-1]))
+        if lineEnd == -1:
+            break
+        if lineEnd + 1 > boundaries[-1]:
+            boundaries.append(lineEnd + 1)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return zip(boundaries, boundaries[1:])
+
+def _grepRange (task):
+    (needle, fileName, start, end) = task
+    with open(fileName, 'rb') as stream:
+        buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offsets = array.array('l')
+            for (lineStart, lineEnd) in _scanLines(buffer, needle, start, end):
+                offsets.append(lineStart)
+                offsets.append(lineEnd)
+            return offsets
+        finally:
+            buffer.close()
+
+class GrepIndex (object):
+    """
+        Splits every line of the haystack once into an inverted index from
+        word to the ids of the lines containing it. Any number of needles
+        can then be looked up without scanning the haystack again. Results
+        are returned in line order.
+    """
+    def __init__ (self, *haystack):
+        self._lines = haystack
+        self._index = {}
+        for (lineId, line) in enumerate(haystack):
+            for word in set(line.split()):
+                self._index.setdefault(word, []).append(lineId)
+    
+    def _lineIds (self, needle):
+        if not needle:
+            raise ValueError("No needle given")
+        return self._index.get(needle, ())
+
+    def grep (self, needle):
+        return [self._lines[lineId] for lineId in self._lineIds(needle)]
+
+    def grepAny (self, *needles):
+        if not needles:
+            raise ValueError("No needle given")
+        
+        lineIds = set()
+        for needle in needles:
+            lineIds.update(self._lineIds(needle))
+        return [self._lines[lineId] for lineId in sorted(lineIds)]
+
+    def grepAll (self, *needles):
+        if not needles:
+            raise ValueError("No needle given")
+        
+        lineIdLists = sorted((self._lineIds(needle) for needle in needles), 
+                             key=len)
+        lineIds = set(lineIdLists[0])
+        for otherLineIds in lineIdLists[1:]:
+            lineIds.intersection_update(otherLineIds)
+        return [self._lines[lineId] for lineId in sorted(lineIds)]
+
 class GrepTest (unittest.TestCase):
     def test_shouldRaiseValueErrorWhenNoNeedleIsGiven (self):
         self.assertRaises(ValueError, grep, None)
@@ -36,4 +377,176 @@ class GrepTest (unittest.TestCase):
         self.assertEquals(["foo", "foo"], grep("foo", "foo", "bar", "foo", "bar"))
 
     def test_shouldReturnListContainingAllMatchingLinesWhenHaystackWithPartiallyMatchingLinesAndNonMatchingLinesIsGiven (self):
-        self.assertEquals(["my foo", "your foo"], grep("foo", "my foo", "my bar", "your foo", "your bar"))
\ No newline at end of file
+        self.assertEquals(["my foo", "your foo"], grep("foo", "my foo", "my bar", "your foo", "your bar"))
+
+class GrepIndexTest (unittest.TestCase):
+    def setUp (self):
+        self.index = GrepIndex("my foo", "my bar", "your foo", "your bar", 
+                               "foo foo")
+
+    def test_shouldRaiseValueErrorWhenNoNeedleIsGiven (self):
+        self.assertRaises(ValueError, self.index.grep, None)
+        self.assertRaises(ValueError, self.index.grepAny)
+        self.assertRaises(ValueError, self.index.grepAll, "foo", "")
+
+    def test_shouldReturnEmptyListWhenHaystackWithoutMatchIsGiven (self):
+        self.assertEquals([], self.index.grep("baz"))
+
+    def test_shouldReturnMatchingLinesInLineOrder (self):
+        self.assertEquals(["my foo", "your foo", "foo foo"], 
+                          self.index.grep("foo"))
+
+    def test_shouldReturnLinesMatchingAnyNeedleInLineOrder (self):
+        self.assertEquals(["my foo", "my bar", "your foo", "foo foo"], 
+                          self.index.grepAny("foo", "my"))
+
+    def test_shouldReturnLinesMatchingAllNeedlesInLineOrder (self):
+        self.assertEquals(["your foo"], self.index.grepAll("foo", "your"))
+
+    def test_shouldReturnSameLinesAsGrep (self):
+        haystack = ["a b c", "b c", "c", "", "a  a"]
+        index = GrepIndex(*haystack)
+        for needle in ["a", "b", "c", "d"]:
+            self.assertEquals(grep(needle, *haystack), index.grep(needle))
+
+class GrepWithStatsTest (unittest.TestCase):
+    def test_shouldRaiseValueErrorWhenNoNeedleIsGiven (self):
+        self.assertRaises(ValueError, grepWithStats, GrepStats(), None)
+
+    def test_shouldReturnSameLinesAsGrep (self):
+        self.assertEquals(["my foo", "your foo"], 
+                          grepWithStats(GrepStats(), "foo", "my foo", 
+                                        "my bar", "your foo"))
+
+    def test_shouldCountLinesBytesAndMatches (self):
+        stats = GrepStats()
+        grepWithStats(stats, "foo", "my foo", "my bar")
+        grepWithStats(stats, "foo", "foo")
+        
+        self.assertEquals(3, stats.linesScanned)
+        self.assertEquals(15, stats.bytesScanned)
+        self.assertEquals(2, stats.matches)
+        self.assertTrue(stats.tokenizeSeconds >= 0)
+        self.assertTrue(stats.matchSeconds >= 0)
+
+class BenchmarkTest (unittest.TestCase):
+    def test_shouldGenerateReproducibleCorpus (self):
+        self.assertEquals(generateCorpus(lines=50, seed=1), 
+                          generateCorpus(lines=50, seed=1))
+
+    def test_shouldGenerateCorpusWithGivenHitRate (self):
+        (needle, haystack) = generateCorpus(lines=1000, hitRate=0.5)
+        
+        self.assertEquals(1000, len(haystack))
+        self.assertTrue(400 < len(grep(needle, *haystack)) < 600)
+
+    def test_shouldTimeEveryEngineForEveryCorpus (self):
+        corpora = [dict(lineLength=5), dict(hitRate=1)]
+        results = benchmark(corpora, lines=20, repeat=1)
+        
+        self.assertEquals(len(corpora) * (len(BENCHMARK_ENGINES) + 1), 
+                          len(results))
+
+class GrepStreamTest (unittest.TestCase):
+    HAYSTACK = ["my foo", "my bar", "your foo", "foobar foo", "", "afoo", 
+                "foo\tbar", " foo ", "bar foo\r", "foo"]
+
+    def setUp (self):
+        (handle, self.fileName) = tempfile.mkstemp()
+        os.write(handle, '\n'.join(GrepStreamTest.HAYSTACK))
+        os.close(handle)
+
+    def tearDown (self):
+        os.remove(self.fileName)
+
+    def test_shouldRaiseValueErrorWhenNoNeedleIsGiven (self):
+        self.assertRaises(ValueError, grepStream, None, [])
+
+    def test_shouldYieldMatchingLinesOfIterable (self):
+        lines = grepStream("foo", iter(GrepStreamTest.HAYSTACK))
+        
+        self.assertEquals(grep("foo", *GrepStreamTest.HAYSTACK), list(lines))
+
+    def test_shouldYieldMatchingLinesOfFile (self):
+        for needle in ["foo", "bar", "my", "afoo", "fo", "o"]:
+            self.assertEquals(grep(needle, *GrepStreamTest.HAYSTACK), 
+                              list(grepStream(needle, self.fileName)))
+
+    def test_shouldYieldNothingWhenNeedleContainsWhitespace (self):
+        self.assertEquals([], list(grepStream("my foo", self.fileName)))
+
+    def test_shouldYieldNothingForEmptyFile (self):
+        with open(self.fileName, 'w'):
+            pass
+        
+        self.assertEquals([], list(grepStream("foo", self.fileName)))
+
+class GrepParallelTest (unittest.TestCase):
+    HAYSTACK = ["my foo", "my bar", "your foo", "foobar foo", "", "afoo", 
+                "foo\tbar", " foo ", "bar foo\r", "foo"] * 20
+
+    def setUp (self):
+        (handle, self.fileName) = tempfile.mkstemp()
+        os.write(handle, '\n'.join(GrepParallelTest.HAYSTACK))
+        os.close(handle)
+
+    def tearDown (self):
+        os.remove(self.fileName)
+
+    def test_shouldRaiseValueErrorWhenNoNeedleIsGiven (self):
+        self.assertRaises(ValueError, grepParallel, None, self.fileName)
+
+    def test_shouldSplitIntoLineAlignedRanges (self):
+        self.assertEquals([(0, 4), (4, 8), (8, 10)], 
+                          _splitLines('aaa\nbbb\ncc', 3))
+        self.assertEquals([(0, 11)], _splitLines('aaaaaaaaaaa', 3))
+        self.assertEquals([(0, 8)], _splitLines('aaaaaaa\n', 3))
+
+    def test_shouldReturnMatchingLinesInLineOrder (self):
+        for needle in ["foo", "bar", "afoo", "o"]:
+            self.assertEquals(grep(needle, *GrepParallelTest.HAYSTACK), 
+                              grepParallel(needle, self.fileName, 
+                                           workers=2, shards=7))
+
+    def test_shouldReturnEmptyListForEmptyFile (self):
+        with open(self.fileName, 'w'):
+            pass
+        
+        self.assertEquals([], grepParallel("foo", self.fileName, workers=2))
+
+class GrepManyTest (unittest.TestCase):
+    def test_shouldRaiseValueErrorWhenNoNeedleIsGiven (self):
+        self.assertRaises(ValueError, grepMany, [])
+        self.assertRaises(ValueError, grepMany, ["foo", None])
+
+    def test_shouldReturnEmptyListWhenHaystackWithoutMatchIsGiven (self):
+        self.assertEquals([], grepMany(["foo", "baz"], "bar"))
+
+    def test_shouldReportMatchedNeedlesInNeedleOrder (self):
+        self.assertEquals([("my foo", ("foo", "my")), 
+                           ("your foo bar", ("bar", "foo"))],
+                          grepMany(["bar", "foo", "my", "foo"], 
+                                   "my foo", "your foo bar", "afoo"))
+
+    def test_shouldAgreeWithGrepPerNeedle (self):
+        haystack = ["a b c", "b c", "c", "", "a  a", "d"]
+        needles = ["a", "b", "c", "e"]
+        matches = grepMany(needles, *haystack)
+        for needle in needles:
+            self.assertEquals(grep(needle, *haystack), 
+                              [line for (line, matched) in matches 
+                               if needle in matched])
+
+    def test_shouldBenchmarkEveryNeedleCount (self):
+        results = benchmarkGrepMany(needleCounts=(1, 5), lines=10)
+        
+        self.assertEquals([1, 5], [count for (count, loop, single) 
+                                   in results])
+
+if __name__ == '__main__':
+    for (corpus, name, seconds) in benchmark():
+        description = ' '.join('%s=%s' % item for item in sorted(corpus.items()))
+        print "%-56s %-16s %.4fs" % (description, name, seconds)
+    for (needleCount, loopSeconds, grepManySeconds) in benchmarkGrepMany():
+        print "%6d needles: grep loop %.4fs, grepMany %.4fs" % \
+            (needleCount, loopSeconds, grepManySeconds)
@@ -9,6 +9,8 @@
     for a good introduction.
 """
 
+import pickle
+import random
 import unittest;
 
 class Score (object):
@@ -87,6 +89,295 @@ class Game (object):
     def currentScorePlayerTwo (self):
         return self._currentScorePlayerTwo
 
+def _buildTransitionTable (initialScores=(Game.LOVE, Game.LOVE)):
+    """
+        Numbers every pair of scores reachable from initialScores using 
+        Score.increment and returns a tuple of the pairs by number plus the 
+        flat transition table: entry state * 2 + player holds the number of 
+        the state after player (0 or 1) scores, or -1 if that player's
+        score has run past game.
+    """
+    states = [initialScores]
+    numbers = {initialScores: 0}
+    transitions = []
+    
+    for (scoreOne, scoreTwo) in states:
+        nextStates = [None, None]
+        if scoreOne is not None:
+            nextStates[0] = scoreOne.increment(scoreTwo)
+        if scoreTwo is not None:
+            nextStates[1] = tuple(reversed(scoreTwo.increment(scoreOne)))
+        
+        for nextState in nextStates:
+            if nextState is None:
+                transitions.append(-1)
+                continue
+            if nextState not in numbers:
+                numbers[nextState] = len(states)
+                states.append(nextState)
+            transitions.append(numbers[nextState])
+    return (tuple(states), tuple(transitions))
+
+class TableGame (object):
+    """
+        A Game keeping its whole state in one small int. Scoring a point is
+        a single lookup in a precomputed transition table instead of calls
+        to Score.increment.
+    """
+    __slots__ = ('state',)
+    
+    (SCORES, TRANSITIONS) = _buildTransitionTable()
+    
+    def __init__ (self, state=0):
+        self.state = state
+    
+    def scorePlayerOne (self):
+        state = TableGame.TRANSITIONS[self.state << 1]
+        if state < 0:
+            raise AttributeError('Player one has already won the game')
+        self.state = state
+    
+    def scorePlayerTwo (self):
+        state = TableGame.TRANSITIONS[self.state << 1 | 1]
+        if state < 0:
+            raise AttributeError('Player two has already won the game')
+        self.state = state
+    
+    @property
+    def currentScorePlayerOne (self):
+        return TableGame.SCORES[self.state][0]
+
+    @property
+    def currentScorePlayerTwo (self):
+        return TableGame.SCORES[self.state][1]
+
+def _buildGameTransitions ():
+    """
+        Returns TableGame.TRANSITIONS with every state in which the scoring 
+        player reaches game replaced by -1.
+    """
+    transitions = list(TableGame.TRANSITIONS)
+    for (i, state) in enumerate(transitions):
+        if state >= 0 and TableGame.SCORES[state][i & 1] is Game.GAME:
+            transitions[i] = -1
+    return tuple(transitions)
+
+_GAME_TRANSITIONS = _buildGameTransitions()
+
+# Layout of the packed states of Set and Match: the lowest 16 bits hold the 
+# points of the current game, a TableGame state or, in a tie-break, 
+# pointsPlayerOne | pointsPlayerTwo << 8. They are followed by the games of 
+# both players (three bits each) and, for a Set, its winner or, for a Match,
+# the sets won by each player (two bits each), the best of five flag and 
+# the games of every completed set (six bits each).
+_POINTS_MASK = (1 << 16) - 1
+_TIE_BREAK_POINTS_MASK = (1 << 8) - 1
+_GAMES_SHIFT = 16
+_TIE_BREAK_GAMES = 6 | 6 << 3
+_SET_MASK = (1 << 22) - 1
+_SETS_SHIFT = 22
+_BEST_OF_FIVE_SHIFT = 26
+_SET_SCORES_SHIFT = 27
+
+def _nextSetState (state, player):
+    """
+        Returns the state of a set (points | games << 16, games being 
+        gamesPlayerOne | gamesPlayerTwo << 3) after player (0 or 1) wins a 
+        point, or -1 if the point wins the set.
+    """
+    games = state >> _GAMES_SHIFT
+    if games == _TIE_BREAK_GAMES:
+        won = (state >> 8 * player & _TIE_BREAK_POINTS_MASK) + 1
+        lost = state >> 8 * (1 - player) & _TIE_BREAK_POINTS_MASK
+        if won >= 7 and won - lost >= 2:
+            return -1
+        if won > _TIE_BREAK_POINTS_MASK:
+            raise ValueError('Tie-break is too long')
+        return state + (1 << 8 * player)
+    
+    points = _GAME_TRANSITIONS[(state & _POINTS_MASK) << 1 | player]
+    if points >= 0:
+        return points | games << _GAMES_SHIFT
+    
+    games += 1 << 3 * player
+    won = games >> 3 * player & 7
+    lost = games >> 3 * (1 - player) & 7
+    if won == 7 or (won == 6 and lost <= 4):
+        return -1
+    return games << _GAMES_SHIFT
+
+class Set (object):
+    """
+        A set of tennis: the first player winning six games with a lead of 
+        two wins the set, at six games all a tie-break decides. The whole 
+        state is one int: bits 0-15 hold the points of the current game (a 
+        TableGame state or tie-break points), bits 16-21 the games and bits
+        22-23 the winner.
+    """
+    __slots__ = ('state',)
+    
+    def __init__ (self, state=0):
+        self.state = state
+    
+    def scorePlayerOne (self):
+        self._score(0)
+    
+    def scorePlayerTwo (self):
+        self._score(1)
+    
+    def _score (self, player):
+        if self.state >> _SETS_SHIFT:
+            raise ValueError('Set is over')
+        state = _nextSetState(self.state, player)
+        if state < 0:
+            state = ((self.state & ~_POINTS_MASK) + 
+                     (1 << _GAMES_SHIFT + 3 * player)) | \
+                (player + 1) << _SETS_SHIFT
+        self.state = state
+    
+    @property
+    def tieBreak (self):
+        return self.state >> _GAMES_SHIFT & 63 == _TIE_BREAK_GAMES
+    
+    @property
+    def currentScorePlayerOne (self):
+        """
+            The Score of player one in the current game or, during a 
+            tie-break, the number of points.
+        """
+        if self.tieBreak:
+            return self.state & _TIE_BREAK_POINTS_MASK
+        return TableGame.SCORES[self.state & _POINTS_MASK][0]
+    
+    @property
+    def currentScorePlayerTwo (self):
+        if self.tieBreak:
+            return self.state >> 8 & _TIE_BREAK_POINTS_MASK
+        return TableGame.SCORES[self.state & _POINTS_MASK][1]
+    
+    @property
+    def gamesPlayerOne (self):
+        return self.state >> _GAMES_SHIFT & 7
+    
+    @property
+    def gamesPlayerTwo (self):
+        return self.state >> _GAMES_SHIFT + 3 & 7
+    
+    @property
+    def winner (self):
+        """
+            1 or 2 for the player who won the set, 0 while it is running.
+        """
+        return self.state >> _SETS_SHIFT
+    
+    def __eq__ (self, other):
+        return isinstance(other, Set) and self.state == other.state
+    
+    def __ne__ (self, other):
+        return not self == other
+    
+    def __hash__ (self):
+        return hash(self.state)
+    
+    def __reduce__ (self):
+        return (Set, (self.state,))
+
+class Match (object):
+    """
+        A best of three or best of five sets match. The whole state is one 
+        int: bits 0-21 hold the current Set without its winner, bits 22-23 
+        and 24-25 the sets won by each player, bit 26 is set for best of 
+        five and every completed set stores its games in six more bits from
+        bit 27 on.
+    """
+    __slots__ = ('state',)
+    
+    def __init__ (self, bestOf=3, state=None):
+        if state is None:
+            if bestOf not in (3, 5):
+                raise ValueError('A match is best of 3 or 5 sets')
+            state = (bestOf == 5) << _BEST_OF_FIVE_SHIFT
+        self.state = state
+    
+    def scorePlayerOne (self):
+        self._score(0)
+    
+    def scorePlayerTwo (self):
+        self._score(1)
+    
+    def _score (self, player):
+        state = self.state
+        if self.winner:
+            raise ValueError('Match is over')
+        
+        setState = _nextSetState(state & _SET_MASK, player)
+        if setState >= 0:
+            self.state = state & ~_SET_MASK | setState
+            return
+        
+        games = (state >> _GAMES_SHIFT & 63) + (1 << 3 * player)
+        setsPlayed = self.setsPlayerOne + self.setsPlayerTwo
+        self.state = ((state & ~_SET_MASK) + 
+                      (1 << _SETS_SHIFT + 2 * player)) | \
+            games << _SET_SCORES_SHIFT + 6 * setsPlayed
+    
+    @property
+    def bestOf (self):
+        return 5 if self.state >> _BEST_OF_FIVE_SHIFT & 1 else 3
+    
+    @property
+    def currentSet (self):
+        return Set(self.state & _SET_MASK)
+    
+    @property
+    def currentScorePlayerOne (self):
+        return self.currentSet.currentScorePlayerOne
+    
+    @property
+    def currentScorePlayerTwo (self):
+        return self.currentSet.currentScorePlayerTwo
+    
+    @property
+    def setsPlayerOne (self):
+        return self.state >> _SETS_SHIFT & 3
+    
+    @property
+    def setsPlayerTwo (self):
+        return self.state >> _SETS_SHIFT + 2 & 3
+    
+    @property
+    def setScores (self):
+        """
+            The games of both players in every completed set.
+        """
+        return [(self.state >> _SET_SCORES_SHIFT + 6 * i & 7, 
+                 self.state >> _SET_SCORES_SHIFT + 6 * i + 3 & 7)
+                for i in range(self.setsPlayerOne + self.setsPlayerTwo)]
+    
+    @property
+    def winner (self):
+        """
+            1 or 2 for the player who won the match, 0 while it is running.
+        """
+        setsToWin = self.bestOf // 2 + 1
+        if self.setsPlayerOne == setsToWin:
+            return 1
+        if self.setsPlayerTwo == setsToWin:
+            return 2
+        return 0
+    
+    def __eq__ (self, other):
+        return isinstance(other, Match) and self.state == other.state
+    
+    def __ne__ (self, other):
+        return not self == other
+    
+    def __hash__ (self):
+        return hash(self.state)
+    
+    def __reduce__ (self):
+        return (Match, (self.bestOf, self.state))
+
 class TennisGameTest (unittest.TestCase):
     def setUp (self):
         self.game = Game()
@@ -211,4 +502,172 @@ class TennisGameTest (unittest.TestCase):
         self.game.scorePlayerTwo()
 
         self.assertEquals(Game.DEUCE, self.game.currentScorePlayerOne)
-        self.assertEquals(Game.DEUCE, self.game.currentScorePlayerTwo)        
+        self.assertEquals(Game.DEUCE, self.game.currentScorePlayerTwo)
+
+class TableGameTest (TennisGameTest):
+    def setUp (self):
+        self.game = TableGame()
+    
+    def test_shouldAgreeWithGameOnEveryPoint (self):
+        generator = random.Random(0)
+        for i in range(1000):
+            game = Game()
+            tableGame = TableGame()
+            for j in range(generator.randint(1, 20)):
+                scorePlayer = generator.choice(['scorePlayerOne', 
+                                                'scorePlayerTwo'])
+                try:
+                    getattr(game, scorePlayer)()
+                except AttributeError:
+                    self.assertRaises(AttributeError, 
+                                      getattr(tableGame, scorePlayer))
+                    break
+                getattr(tableGame, scorePlayer)()
+                
+                self.assertEquals((game.currentScorePlayerOne, 
+                                   game.currentScorePlayerTwo), 
+                                  (tableGame.currentScorePlayerOne, 
+                                   tableGame.currentScorePlayerTwo))
+
+def scorePoints (target, players):
+    for player in players:
+        if player == '1':
+            target.scorePlayerOne()
+        else:
+            target.scorePlayerTwo()
+
+class SetTest (unittest.TestCase):
+    def setUp (self):
+        self.set = Set()
+    
+    def test_shouldReportScoresOfCurrentGame (self):
+        scorePoints(self.set, '1111' + '12')
+        
+        self.assertEquals(1, self.set.gamesPlayerOne)
+        self.assertEquals(0, self.set.gamesPlayerTwo)
+        self.assertEquals(Game.FIFTEEN, self.set.currentScorePlayerOne)
+        self.assertEquals(Game.FIFTEEN, self.set.currentScorePlayerTwo)
+    
+    def test_shouldBeWonByPlayerOneAfterSixGamesToLove (self):
+        scorePoints(self.set, '1111' * 6)
+        
+        self.assertEquals(1, self.set.winner)
+        self.assertEquals((6, 0), (self.set.gamesPlayerOne, 
+                                   self.set.gamesPlayerTwo))
+        self.assertRaises(ValueError, self.set.scorePlayerTwo)
+    
+    def test_shouldNeedLeadOfTwoGamesToWinSet (self):
+        scorePoints(self.set, '11112222' * 5 + '1111')
+        self.assertEquals(0, self.set.winner)
+        
+        scorePoints(self.set, '1111')
+        self.assertEquals(1, self.set.winner)
+        self.assertEquals((7, 5), (self.set.gamesPlayerOne, 
+                                   self.set.gamesPlayerTwo))
+    
+    def test_shouldPlayTieBreakAtSixGamesAll (self):
+        scorePoints(self.set, '11112222' * 6)
+        self.assertTrue(self.set.tieBreak)
+        
+        scorePoints(self.set, '2222221')
+        self.assertEquals((1, 6), (self.set.currentScorePlayerOne, 
+                                   self.set.currentScorePlayerTwo))
+        
+        scorePoints(self.set, '2')
+        self.assertEquals(2, self.set.winner)
+        self.assertEquals((6, 7), (self.set.gamesPlayerOne, 
+                                   self.set.gamesPlayerTwo))
+    
+    def test_shouldNeedLeadOfTwoPointsToWinTieBreak (self):
+        scorePoints(self.set, '11112222' * 6 + '121212121212')
+        scorePoints(self.set, '12' * 100 + '1')
+        self.assertEquals(0, self.set.winner)
+        self.assertEquals((107, 106), (self.set.currentScorePlayerOne, 
+                                       self.set.currentScorePlayerTwo))
+        
+        scorePoints(self.set, '1')
+        self.assertEquals(1, self.set.winner)
+        self.assertEquals((7, 6), (self.set.gamesPlayerOne, 
+                                   self.set.gamesPlayerTwo))
+
+class MatchTest (unittest.TestCase):
+    def test_shouldBeWonAfterTwoSetsInBestOfThree (self):
+        match = Match()
+        scorePoints(match, '1111' * 6 + '2222' * 6 + '1111' * 6)
+        
+        self.assertEquals(1, match.winner)
+        self.assertEquals([(6, 0), (0, 6), (6, 0)], match.setScores)
+        self.assertRaises(ValueError, match.scorePlayerOne)
+    
+    def test_shouldBeWonAfterThreeSetsInBestOfFive (self):
+        match = Match(bestOf=5)
+        scorePoints(match, '2222' * 12)
+        self.assertEquals(0, match.winner)
+        
+        scorePoints(match, '11112222' * 6 + '2222222')
+        self.assertEquals(2, match.winner)
+        self.assertEquals([(0, 6), (0, 6), (6, 7)], match.setScores)
+    
+    def test_shouldRejectOtherNumbersOfSets (self):
+        self.assertRaises(ValueError, Match, 4)
+    
+    def test_shouldCopyHashAndPickleByState (self):
+        match = Match(bestOf=5)
+        scorePoints(match, '1111' * 6 + '11112222' * 3 + '12')
+        
+        copy = Match(state=match.state)
+        self.assertEquals(match, copy)
+        self.assertEquals(hash(match), hash(copy))
+        self.assertEquals(match, pickle.loads(pickle.dumps(match)))
+        self.assertEquals(5, copy.bestOf)
+        
+        copy.scorePlayerOne()
+        self.assertNotEquals(match, copy)
+    
+    def test_shouldAgreeWithGamesAndCountersOnEveryPoint (self):
+        generator = random.Random(0)
+        for i in range(20):
+            match = Match(bestOf=generator.choice([3, 5]))
+            setScores = []
+            games = [0, 0]
+            tieBreak = [0, 0]
+            game = Game()
+            while not match.winner:
+                player = generator.randint(0, 1)
+                if player == 0:
+                    match.scorePlayerOne()
+                else:
+                    match.scorePlayerTwo()
+                
+                if games == [6, 6]:
+                    tieBreak[player] += 1
+                    gameWon = tieBreak[player] >= 7 and \
+                        tieBreak[player] - tieBreak[1 - player] >= 2
+                else:
+                    if player == 0:
+                        game.scorePlayerOne()
+                    else:
+                        game.scorePlayerTwo()
+                    gameWon = Game.GAME in (game.currentScorePlayerOne, 
+                                            game.currentScorePlayerTwo)
+                if gameWon:
+                    games[player] += 1
+                    game = Game()
+                    tieBreak = [0, 0]
+                    if games[player] == 7 or \
+                            (games[player] == 6 and games[1 - player] <= 4):
+                        setScores.append(tuple(games))
+                        games = [0, 0]
+                
+                self.assertEquals(setScores, match.setScores)
+                self.assertEquals(games, [match.currentSet.gamesPlayerOne,
+                                          match.currentSet.gamesPlayerTwo])
+                if games == [6, 6]:
+                    self.assertEquals(tuple(tieBreak), 
+                                      (match.currentScorePlayerOne, 
+                                       match.currentScorePlayerTwo))
+                else:
+                    self.assertEquals((game.currentScorePlayerOne, 
+                                       game.currentScorePlayerTwo), 
+                                      (match.currentScorePlayerOne, 
+                                       match.currentScorePlayerTwo))